@@ -1,12 +1,18 @@
 import gradio as gr
 
-def get_readme_content():
+def _load_readme():
     try:
         with open("README.md", "r", encoding="utf-8") as f:
             return f.read()
     except Exception:
         return "# iOS MCP Server\n\nWelcome! This tool is designed to run locally with a physical iOS device connected."
 
+# Read once at import; the README doesn't change while the Space is running.
+_README = _load_readme()
+
+def get_readme_content():
+    return _README
+
 with gr.Blocks() as demo:
     gr.Markdown(
         """
@@ -1,22 +1,191 @@
+import asyncio
 import chromadb
 from chromadb.config import Settings
-import json
+from collections import defaultdict
+import concurrent.futures
+import functools
+import heapq
+import operator
+import orjson
 import os
-from typing import List, Dict, Any, Set
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Set, Tuple, Optional, Callable, Iterator
+
+try:
+    from rapidfuzz import fuzz, process as fuzz_process
+except ImportError:
+    # Fall back to the (pure Python) stdlib matcher
+    fuzz = fuzz_process = None
+    import difflib
+
+# Technical fields left out of the semantic-search document.
+_DOC_SKIP_FIELDS = frozenset({'SourceFile', 'Directory', 'FilePermissions'})
+# Value types Chroma accepts as metadata.
+_METADATA_TYPES = (str, int, float, bool)
+# Result parts fetched for rows: documents/embeddings are never returned to callers.
+_QUERY_INCLUDE = ['metadatas', 'distances']
+_GET_INCLUDE = ['metadatas']
+# Comparison operators for in-memory $match; missing values never match these.
+_RANGE_OPS = {"$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+def _typed_sort_key(val: Any) -> Tuple[int, float, str]:
+    """
+    Sort key ranking None < numbers < everything else (compared as strings).
+    """
+    if val is None:
+        return (0, 0.0, "")
+    if isinstance(val, (int, float)):
+        return (1, float(val), "")
+    return (2, 0.0, str(val))
+
+def _sort_top(items: List[Any], key: Callable[[Any], Any], reverse: bool = False, keep: Optional[int] = None) -> List[Any]:
+    """
+    Stable sort of `items`; when only the first `keep` are needed and that is a
+    small share of them, select those with a heap instead of sorting everything.
+    The result may be `items` itself, sorted in place.
+    """
+    if keep is not None and keep * 4 < len(items):
+        return (heapq.nlargest if reverse else heapq.nsmallest)(keep, items, key=key)
+    items.sort(key=key, reverse=reverse)
+    return items
+
+# Default number of nearest matches a semantic count_files considers
+SEMANTIC_COUNT_LIMIT = 1000
+# Nearest matches post-processed (sorted/grouped) when a semantic search has no page size
+SEMANTIC_SCAN_LIMIT = 2000
+# Seconds a count_files/group_files_by_field result is reused for identical calls
+RESULT_CACHE_TTL = 30.0
+def _chroma_supports(op: str, value: Any, exact: bool = False) -> bool:
+    """
+    Whether Chroma's where filter can evaluate `op: value`. Chroma only
+    range-compares numbers, so string ranges (e.g. dates) stay in memory, and
+    it rejects $in/$nin lists mixing value types.
+    With `exact`, also refuse what Chroma evaluates differently from the
+    in-memory $match: Chroma never compares a bool with a number, where Python
+    treats True as 1, so ints and bools aren't compared for (in)equality and
+    ranges (which bool values may fall in) stay in memory.
+    """
+    if op in ("$eq", "$ne"):
+        return isinstance(value, _METADATA_TYPES) and not (exact and type(value) in (int, bool))
+    if op in _RANGE_OPS:
+        return isinstance(value, (int, float)) and not isinstance(value, bool) and not exact
+    if op in ("$in", "$nin"):
+        if not (isinstance(value, list) and value):
+            return False
+        # One exact type throughout: bool apart from int, int apart from float
+        kind = type(value[0])
+        return (kind in _METADATA_TYPES and all(type(v) is kind for v in value)
+                and not (exact and kind in (int, bool)))
+    return False
+
+# Runs aggregate()'s Chroma fetch while the caller compiles the in-memory stages
+_FETCH_EXECUTOR = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="db-fetch")
+def _env_batch_size(default: int = 200) -> int:
+    """
+    Upsert batch size from the MCP_CHROMA_BATCH environment variable, at
+    least 1. Falls back to `default` (with a warning) if it isn't an integer.
+    """
+    value = os.environ.get("MCP_CHROMA_BATCH")
+    if not value:
+        return default
+    try:
+        return max(1, int(value))
+    except ValueError:
+        print(f"Warning: Ignoring invalid MCP_CHROMA_BATCH={value!r}; using {default}")
+        return default
+
+# Records per collection.upsert call; ChromaDB ingests fastest in the low hundreds.
+# Override with the MCP_CHROMA_BATCH environment variable.
+UPSERT_BATCH_SIZE = _env_batch_size()
 
 class Database:
-    def __init__(self, db_path: str = "/Users/harsha/GitProjects/ios_mcp/chroma_db"):
+    def __init__(self, db_path: str = "/Users/harsha/GitProjects/ios_mcp/chroma_db", batch_size: int = UPSERT_BATCH_SIZE):
         self.client = chromadb.PersistentClient(path=db_path)
         self.collection = self.client.get_or_create_collection(name="files")
+        self.batch_size = max(1, batch_size)
+        # Whether collection.count() accepts a where filter (None = not probed yet)
+        self._has_count_where: Optional[bool] = None
+        # Recent count/group results: cache key -> (time.monotonic(), value)
+        self._result_cache: Dict[bytes, Tuple[float, Any]] = {}
+        # Full-collection rows shared by analytical reads (see _get_all_cached)
+        self._snapshot: Optional[List[Dict[str, Any]]] = None
+        self._snapshot_count = -1
+        self._snapshot_time = 0.0
+        # Reads run concurrently (see AsyncDatabase): the result cache and the
+        # snapshot are only touched under this lock. The generation counts
+        # writes, so a read that overlapped one doesn't cache what it saw.
+        self._cache_lock = threading.Lock()
+        self._cache_generation = 0
+        # Compiled aggregation pipelines, keyed by their JSON form
+        self._compile_pipeline = functools.lru_cache(maxsize=256)(self._compile_pipeline)
         self.cache_path = os.path.join(db_path, "metadata_keys.json")
+        # In-memory copy of the keys cache (None = not loaded yet) and the
+        # (mtime_ns, size) of the cache file it was loaded from.
+        self._known_keys: Optional[Set[str]] = None
+        self._keys_stamp: Optional[Tuple[int, int]] = None
+        # Sorted list of the same keys, built lazily for fuzzy matching, and
+        # its case-folded copy (with the list it was built from)
+        self._keys_list: Optional[List[str]] = None
+        self._folded_keys: Tuple[Optional[List[str]], List[str], Dict[str, List[str]]] = (None, [], {})
+        # Category (e.g. "EXIF", or "General" for keys without a prefix) -> sorted keys
+        self._key_categories: Dict[str, List[str]] = {}
+        # Guards the keys cache (memory and file); reentrant as a reload may rebuild it
+        self._keys_lock = threading.RLock()
+
+        # Scan index: every indexed path, plus its (mtime_ns, size) as it was when
+        # last indexed. Lets incremental scans skip unchanged files and re-read
+        # modified ones without pulling every ID out of Chroma.
+        self.index_path = os.path.join(db_path, "scan_index.sqlite")
+        self._index = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._index.execute("PRAGMA journal_mode=WAL")
+        self._index.execute("PRAGMA synchronous=NORMAL")
+        self._index.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER)"
+        )
+        self._index.commit()
 
     def upsert_files(self, metadata_list: List[Dict[str, Any]]):
         """
         Batch insert or update file metadata.
+        Large inputs are written in windows of `batch_size`; the next window is
+        prepared while the previous one is being embedded and written.
         """
         if not metadata_list:
             return
 
+        size = self.batch_size
+        if len(metadata_list) <= size:
+            self._write_batch(*self._prepare_batch(metadata_list))
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as writer:
+            pending = None
+            for start in range(0, len(metadata_list), size):
+                batch = self._prepare_batch(metadata_list[start:start + size])
+                if pending is not None:
+                    pending.result() # At most one window in flight
+                pending = writer.submit(self._write_batch, *batch)
+            pending.result()
+
+    def upsert_files_soa(self, source_files: List[str], documents: List[str], metadatas: List[Dict[str, Any]]):
+        """
+        Batch insert or update files given as parallel columns, skipping the
+        list-of-dicts transposition in upsert_files. Metadata values must
+        already be str, int, float or bool.
+        """
+        if not (len(source_files) == len(documents) == len(metadatas)):
+            raise ValueError("source_files, documents and metadatas must have the same length")
+
+        size = self.batch_size
+        for start in range(0, len(source_files), size):
+            end = start + size
+            self._write_batch(source_files[start:end], documents[start:end], metadatas[start:end])
+
+    def _prepare_batch(self, metadata_list: List[Dict[str, Any]]) -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
+        """
+        Build the ids, documents and Chroma-safe metadatas for a batch.
+        """
         ids = []
         documents = []
         metadatas = []
@@ -28,96 +197,275 @@ class Database:
                 # Create a string representation for semantic search
                 # We include key fields like Model, Date, Location if available
                 # Or just dump the whole JSON as the document content
-                doc_str = f"File: {os.path.basename(path)}\n"
-                for k, v in meta.items():
-                    if k not in ['SourceFile', 'Directory', 'FilePermissions']: # Skip technical fields
-                        doc_str += f"{k}: {v}\n"
-                documents.append(doc_str)
-                
+                doc_lines = [f"File: {os.path.basename(path)}"]
+
                 # Chroma metadata values must be str, int, float, or bool. 
                 # It doesn't support nested dicts or lists in metadata.
                 # We need to flatten or filter metadata.
                 clean_meta = {}
                 for k, v in meta.items():
-                    if isinstance(v, (str, int, float, bool)):
-                        clean_meta[k] = v
-                    else:
-                        clean_meta[k] = str(v) # Convert complex types to string
+                    if k not in _DOC_SKIP_FIELDS: # Skip technical fields
+                        doc_lines.append(f"{k}: {v}")
+                    clean_meta[k] = v if isinstance(v, _METADATA_TYPES) else str(v) # Convert complex types to string
+                doc_lines.append("")
+                documents.append("\n".join(doc_lines))
                 metadatas.append(clean_meta)
 
-        if ids:
-            # Chroma handles batching automatically, but for very large sets we might want to chunk
-            # Default batch size is usually fine for < 40k items
-            self.collection.upsert(
-                ids=ids,
-                documents=documents,
-                metadatas=metadatas
+        return ids, documents, metadatas
+
+    def _write_batch(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]):
+        """
+        Upsert a prepared batch into Chroma and record it in the scan index and keys cache.
+        """
+        if not ids:
+            return
+        self.collection.upsert(
+            ids=ids,
+            documents=documents,
+            metadatas=metadatas
+        )
+        with self._index:
+            self._index.executemany(
+                "INSERT OR IGNORE INTO files (path) VALUES (?)", [(i,) for i in ids]
             )
+        # Only now: a read made while the write was in flight may have cached
+        # the old state
+        self._invalidate_reads()
+        self._merge_keys(metadatas)
 
-    def query_files(self, query: str = None, where: Dict[str, Any] = None, n_results: int = 10) -> List[Dict[str, Any]]:
+    def _invalidate_reads(self):
+        """
+        Drop the cached results and snapshot after a write.
+        """
+        with self._cache_lock:
+            self._result_cache.clear()
+            self._snapshot = None
+            self._cache_generation += 1
+
+    def query_files(self, query: str = None, where: Dict[str, Any] = None, n_results: int = 10,
+                    projection: List[str] = None) -> List[Dict[str, Any]]:
         """
         Search files.
         - If `query` is provided: Performs semantic search (nearest neighbors), optionally filtered by `where`.
         - If only `where` is provided: Performs exact filtering (e.g., {'Model': 'iPhone 12'}).
         - Provide n_results on how many output results you want. If not needed pass None.
+        - Pass `projection` (list of metadata fields) to return only those fields plus SourceFile (and score).
         """
         if not query and not where:
             return []
 
-        output = []
-        
         if query:
             # Semantic search with optional filter
             results = self.collection.query(
                 query_texts=[query],
                 where=where,
-                n_results=n_results
+                n_results=n_results,
+                include=_QUERY_INCLUDE
             )
             # Process semantic results
-            if results['metadatas'] and len(results['metadatas']) > 0:
-                 for i, meta in enumerate(results['metadatas'][0]):
-                     meta['SourceFile'] = results['ids'][0][i]
-                     meta['score'] = results['distances'][0][i]
-                     output.append(meta)
+            output = self._query_rows(results, projection)
         else:
             # Exact filtering only (no semantic search)
             results = self.collection.get(
                 where=where,
-                limit=n_results
+                limit=n_results,
+                include=_GET_INCLUDE
             )
             # Process filter results
-            if results['metadatas']:
-                for i, meta in enumerate(results['metadatas']):
-                    meta['SourceFile'] = results['ids'][i]
-                    output.append(meta)
+            output = self._get_rows(results, projection)
 
         return output
 
-    def get_all_files(self) -> List[Dict[str, Any]]:
+    def _unpack_query(self, results: Dict[str, Any]) -> Tuple[List[str], List[Dict[str, Any]], List[float]]:
+        """
+        (ids, metadatas, distances) of the first query in a collection.query() result.
+        Missing parts come back as empty lists.
+        """
+        ids = results.get('ids') or [[]]
+        metas = results.get('metadatas') or [[]]
+        distances = results.get('distances') or [[]]
+        return ids[0], metas[0], distances[0]
+
+    def _unpack_get(self, results: Dict[str, Any]) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """
+        (ids, metadatas) of a collection.get() result. Missing parts come back as empty lists.
+        """
+        return results.get('ids') or [], results.get('metadatas') or []
+
+    def _query_rows(self, results: Dict[str, Any], projection: List[str] = None) -> List[Dict[str, Any]]:
+        """
+        Result rows (metadata + SourceFile + score) of a collection.query() result,
+        narrowed to the `projection` fields if given.
+        """
+        ids, metas, distances = self._unpack_query(results)
+        if projection:
+            return [
+                {'SourceFile': path, **{f: meta[f] for f in projection if f in meta}, 'score': distance}
+                for path, meta, distance in zip(ids, metas, distances)
+            ]
+        return [
+            {**meta, 'SourceFile': path, 'score': distance}
+            for path, meta, distance in zip(ids, metas, distances)
+        ]
+
+    def _get_rows(self, results: Dict[str, Any], projection: List[str] = None) -> List[Dict[str, Any]]:
+        """
+        Result rows (metadata + SourceFile) of a collection.get() result,
+        narrowed to the `projection` fields if given.
+        """
+        ids, metas = self._unpack_get(results)
+        if projection:
+            return [
+                {'SourceFile': path, **{f: meta[f] for f in projection if f in meta}}
+                for path, meta in zip(ids, metas)
+            ]
+        return [{**meta, 'SourceFile': path} for path, meta in zip(ids, metas)]
+
+    def get_all_files(self, projection: List[str] = None) -> List[Dict[str, Any]]:
         """
         Get all files. Note: Chroma isn't optimized for "get all", 
-        but we can use get() without ids.
-        """
-        results = self.collection.get()
-        output = []
-        if results['metadatas']:
-            for i, meta in enumerate(results['metadatas']):
-                meta['SourceFile'] = results['ids'][i]
-                output.append(meta)
-        return output
+        so this is served from a short-lived snapshot of the collection.
+        Pass `projection` to return only those fields plus SourceFile.
+        """
+        if projection:
+            return [
+                {'SourceFile': row['SourceFile'], **{f: row[f] for f in projection if f in row}}
+                for row in self._get_all_cached()
+            ]
+        return [dict(row) for row in self._get_all_cached()]
+
+    def _get_all_cached(self) -> List[Dict[str, Any]]:
+        """
+        Every file's row (metadata + SourceFile), fetched once and reused while
+        it is under RESULT_CACHE_TTL old, the collection count is unchanged and
+        nothing was written through this Database. Rows are shared: don't mutate.
+        """
+        count = self.collection.count()
+        now = time.monotonic()
+        with self._cache_lock:
+            if (self._snapshot is not None and count == self._snapshot_count
+                    and now - self._snapshot_time < RESULT_CACHE_TTL):
+                return self._snapshot
+            generation = self._cache_generation
+
+        rows = list(self.iter_all_files())
+        with self._cache_lock:
+            if generation == self._cache_generation:
+                self._snapshot, self._snapshot_count, self._snapshot_time = rows, count, now
+        return rows
 
-    def get_existing_files_map(self) -> Set[str]:
+    def iter_all_files(self, page_size: int = 10000) -> Iterator[Dict[str, Any]]:
         """
-        Returns a set of existing file paths.
+        Yield the metadata of every file, fetched from Chroma `page_size` rows
+        at a time so only one page is held in memory at once.
+        """
+        offset = 0
+        while True:
+            results = self.collection.get(limit=page_size, offset=offset, include=_GET_INCLUDE)
+            ids, metas = self._unpack_get(results)
+            if not ids:
+                break
+            for path, meta in zip(ids, metas or [None] * len(ids)):
+                yield {**(meta or {}), 'SourceFile': path}
+            if len(ids) < page_size:
+                break
+            offset += page_size
+
+    def get_existing_files_map(self) -> Dict[str, Optional[Tuple[int, int]]]:
+        """
+        Returns a map of existing file path -> (mtime_ns, size) recorded when it was indexed.
+        The signature is None for files indexed before signatures were tracked.
         Used for incremental scanning.
         """
+        self._sync_index()
+        rows = self._index.execute("SELECT path, mtime_ns, size FROM files")
+        return {
+            path: (mtime_ns, size) if mtime_ns is not None else None
+            for path, mtime_ns, size in rows
+        }
+
+    def filter_existing(self, paths: List[str], chunk_size: int = 10000) -> Set[str]:
+        """
+        Returns the subset of `paths` already stored in the collection.
+        Membership is checked by Chroma's ID lookup, so the cost scales with
+        the number of candidates rather than the size of the collection.
+        """
+        existing = set()
+        for start in range(0, len(paths), chunk_size):
+            chunk = paths[start:start + chunk_size]
+            existing.update(self.collection.get(ids=chunk, include=[])['ids'])
+        return existing
+
+    def _sync_index(self):
+        """
+        Bring the scan index in line with the collection when their counts
+        disagree (first run on an existing database, or the collection was
+        changed behind our back). Only then are all IDs fetched from Chroma.
+        """
+        (indexed,) = self._index.execute("SELECT COUNT(*) FROM files").fetchone()
+        if indexed == self.collection.count():
+            return
+
         # We just need IDs
         results = self.collection.get(include=[]) # Don't include embeddings or metadata
-        return set(results['ids'])
+        ids = set(results['ids'])
+        stale = [
+            (path,) for (path,) in self._index.execute("SELECT path FROM files")
+            if path not in ids
+        ]
+        with self._index:
+            self._index.executemany("DELETE FROM files WHERE path = ?", stale)
+            self._index.executemany(
+                "INSERT OR IGNORE INTO files (path) VALUES (?)", [(i,) for i in ids]
+            )
+
+    def get_file_signatures(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Returns path -> (mtime_ns, size) for every file in the scan index.
+        """
+        rows = self._index.execute(
+            "SELECT path, mtime_ns, size FROM files WHERE mtime_ns IS NOT NULL"
+        )
+        return {path: (mtime_ns, size) for path, mtime_ns, size in rows}
+
+    def record_file_signatures(self, signatures: Dict[str, Tuple[int, int]]):
+        """
+        Store (mtime_ns, size) for freshly indexed files in a single transaction.
+        """
+        if not signatures:
+            return
+        with self._index:
+            self._index.executemany(
+                "INSERT OR REPLACE INTO files (path, mtime_ns, size) VALUES (?, ?, ?)",
+                [(path, mtime_ns, size) for path, (mtime_ns, size) in signatures.items()]
+            )
+
+    def enable_bulk_mode(self):
+        """
+        Relax the scan index's durability for the duration of a bulk ingest.
+        With synchronous=OFF an application crash is still safe, but an OS crash
+        or power loss mid-ingest can corrupt scan_index.sqlite; deleting it is
+        then enough, as it is rebuilt from the collection on the next scan.
+        """
+        self._index.execute("PRAGMA synchronous=OFF")
+        self._index.execute("PRAGMA temp_store=MEMORY")
+
+    def disable_bulk_mode(self):
+        """
+        Restore normal durability after a bulk ingest and fold the WAL back
+        into the main index file.
+        """
+        self._index.execute("PRAGMA synchronous=NORMAL")
+        self._index.execute("PRAGMA temp_store=DEFAULT")
+        self._index.execute("PRAGMA wal_checkpoint(TRUNCATE)")
 
     def clear_db(self):
         self.client.delete_collection("files")
         self.collection = self.client.get_or_create_collection(name="files")
+        with self._index:
+            self._index.execute("DELETE FROM files")
+        self._invalidate_reads()
+        self._write_keys_cache(set())
 
     def _scan_all_keys_from_db(self) -> Set[str]:
         """
@@ -125,10 +473,8 @@ class Database:
         This is expensive and should only be used to update the cache.
         """
         keys = set()
-        results = self.collection.get(include=['metadatas'])
-        if results['metadatas']:
-            for meta in results['metadatas']:
-                keys.update(meta.keys())
+        for meta in self._get_all_cached():
+            keys.update(meta.keys())
         return keys
 
     def get_all_keys(self) -> Set[str]:
@@ -136,47 +482,111 @@ class Database:
         Get all unique metadata keys (columns) present in the database.
         Uses the cache for performance.
         """
-        # Use get_cached_keys to retrieve everything (category=None returns prefixes, 
-        # but we want ALL keys here? Wait.
-        # get_cached_keys(category=None) returns CATEGORIES.
-        # We need a way to get ALL keys from cache.
-        # Let's check get_cached_keys implementation again.
-        
-        # Actually, get_cached_keys loads the full list from JSON first.
-        # We can just load the JSON directly or add a mode to get_cached_keys.
-        # Or better, let's just use the cache loading logic here or make get_cached_keys return all if a specific flag is set.
-        
-        # But wait, get_cached_keys(category=None) returns categories.
-        # If I pass a category that matches everything? No.
-        
-        # Let's modify get_cached_keys to support returning ALL keys if requested, 
-        # OR just duplicate the simple load logic here since it's cleaner.
-        
-        if not os.path.exists(self.cache_path):
-             return set(self.update_keys_cache())
-             
-        try:
-            with open(self.cache_path, 'r') as f:
-                keys = json.load(f)
-            return set(keys)
-        except (json.JSONDecodeError, IOError):
-            return set(self.update_keys_cache())
+        return set(self._load_keys())
 
     def update_keys_cache(self) -> List[str]:
         """
         Scan the database for all unique keys and update the cache file.
         Returns the list of keys.
         """
-        keys = list(self._scan_all_keys_from_db())
-        keys.sort()
-        
-        try:
-            with open(self.cache_path, 'w') as f:
-                json.dump(keys, f)
-        except Exception as e:
-            print(f"Warning: Failed to write keys cache: {e}")
-            
-        return keys
+        keys = self._scan_all_keys_from_db()
+        self._write_keys_cache(keys)
+        return sorted(keys)
+
+    def _load_keys(self) -> Set[str]:
+        """
+        Return the cached key set, reading the cache file only when it changed
+        since it was last read, and scanning the database only if there is no
+        usable cache file at all.
+        """
+        with self._keys_lock:
+            try:
+                st = os.stat(self.cache_path)
+            except OSError:
+                self.update_keys_cache()
+                return self._known_keys
+
+            stamp = (st.st_mtime_ns, st.st_size)
+            if self._known_keys is None or stamp != self._keys_stamp:
+                try:
+                    with open(self.cache_path, 'rb') as f:
+                        data = orjson.loads(f.read())
+                    if isinstance(data, dict):
+                        self._known_keys = set(data['keys'])
+                        self._key_categories = data['categories']
+                        self._keys_stamp = stamp
+                        self._keys_list = None
+                    else:
+                        # Old format: a flat list of keys. Rewrite it with categories.
+                        self._write_keys_cache(set(data))
+                except (orjson.JSONDecodeError, KeyError, TypeError, IOError):
+                    self.update_keys_cache()
+            return self._known_keys
+
+    def _write_keys_cache(self, keys: Set[str]):
+        """
+        Replace the keys cache (memory and file) with `keys`.
+        """
+        with self._keys_lock:
+            self._known_keys = set(keys)
+            self._keys_list = sorted(keys)
+            categories: Dict[str, List[str]] = {}
+            for k in self._keys_list:
+                cat = k.split(":")[0] if ":" in k else "General"
+                categories.setdefault(cat, []).append(k)
+            self._key_categories = categories
+            try:
+                with open(self.cache_path, 'wb') as f:
+                    f.write(orjson.dumps({"keys": self._keys_list, "categories": categories}))
+                st = os.stat(self.cache_path)
+                self._keys_stamp = (st.st_mtime_ns, st.st_size)
+            except Exception as e:
+                self._keys_stamp = None
+                print(f"Warning: Failed to write keys cache: {e}")
+
+    def _sorted_keys(self) -> List[str]:
+        """
+        Sorted list of the cached keys, rebuilt only when the key set changes.
+        Callers must not mutate it.
+        """
+        with self._keys_lock:
+            keys = self._load_keys()
+            if self._keys_list is None:
+                self._keys_list = sorted(keys)
+            return self._keys_list
+
+    def _casefolded_keys(self) -> Tuple[List[str], List[str], Dict[str, List[str]]]:
+        """
+        (sorted keys, their lower-cased forms, lower-cased form -> keys), built
+        once per key set so fuzzy matching doesn't re-normalise every key per call.
+        """
+        with self._keys_lock:
+            keys = self._sorted_keys()
+            source, folded, by_folded = self._folded_keys
+            if source is not keys:
+                folded = [k.lower() for k in keys]
+                by_folded = {}
+                for key, low in zip(keys, folded):
+                    by_folded.setdefault(low, []).append(key)
+                self._folded_keys = (keys, folded, by_folded)
+            return keys, folded, by_folded
+
+    def _merge_keys(self, metadatas: List[Dict[str, Any]]):
+        """
+        Fold the keys of freshly upserted metadata into the keys cache, so it
+        stays current without rescanning the collection. If the cache has not
+        been built yet it is left alone; the first read builds it.
+        """
+        with self._keys_lock:
+            if self._known_keys is None and not os.path.exists(self.cache_path):
+                return
+            known = self._load_keys()
+            new_keys = set()
+            for meta in metadatas:
+                new_keys.update(meta.keys())
+            new_keys -= known
+            if new_keys:
+                self._write_keys_cache(known | new_keys)
 
     def get_cached_keys(self, category: str = None, refresh: bool = False) -> List[str]:
         """
@@ -184,57 +594,41 @@ class Database:
         If category is None, returns a list of unique prefixes (e.g. "EXIF", "IPTC").
         If category is provided, returns keys matching that prefix (e.g. "EXIF:Model").
         """
-        keys = []
-        
-        # 1. Load Keys
-        if refresh or not os.path.exists(self.cache_path):
-            keys = self.update_keys_cache()
+        if refresh:
+            self.update_keys_cache()
         else:
-            try:
-                with open(self.cache_path, 'r') as f:
-                    keys = json.load(f)
-            except (json.JSONDecodeError, IOError):
-                keys = self.update_keys_cache()
-                
-        # 2. Filter/Process
+            self._load_keys()
+        categories = self._key_categories
+
         if category:
-            # Return keys belonging to the category
-            # Category is typically a prefix ending with ":" like "EXIF" -> "EXIF:"
-            # But the user might pass "EXIF" or "EXIF:"
-            prefix = category if category.endswith(":") else f"{category}:"
-            filtered_keys = [k for k in keys if k.startswith(prefix)]
-            return filtered_keys
-        else:
-            # Return unique categories (prefixes)
-            categories = set()
-            for k in keys:
-                if ":" in k:
-                    # "EXIF:Model" -> "EXIF"
-                    cat = k.split(":")[0]
-                    categories.add(cat)
-                else:
-                    # "Model" -> "General" or just keep it?
-                    # The user request said "customise these keys. they have two parts split with ':'"
-                    # So we assume most have ":". If not, maybe put them in "Other"?
-                    # Or just return them as is?
-                    # Let's put them in "General" or just list them if they are top level.
-                    # Actually, if we return categories, we should probably return "General" for those without ":".
-                    categories.add("General")
-            
-            cat_list = list(categories)
-            cat_list.sort()
-            return cat_list
+            # The user might pass "EXIF" or "EXIF:"
+            name = category[:-1] if category.endswith(":") else category
+            if name in categories:
+                return list(categories[name])
+            # Nested prefixes such as "XMP:XMP-dc" are not stored as categories
+            prefix = f"{name}:"
+            return [k for k in self._sorted_keys() if k.startswith(prefix)]
+        # Return unique categories; keys without a ":" prefix fall under "General"
+        return sorted(categories)
 
     def find_similar_keys(self, search_key: str, n: int = 5) -> List[str]:
         """
         Find metadata keys similar to the search_key using fuzzy matching.
         Useful for correcting LLM hallucinations (e.g. 'CameraModel' -> 'Model').
         """
-        import difflib
-        all_keys = list(self.get_all_keys())
-        # Get close matches
-        matches = difflib.get_close_matches(search_key, all_keys, n=n, cutoff=0.4)
-        return matches
+        if search_key in self._load_keys():
+            return [search_key] # Already a valid key: nothing to correct
+        all_keys, folded, by_folded = self._casefolded_keys()
+        # Get close matches, ignoring case ("iso" -> "EXIF:ISO")
+        target = search_key.lower()
+        if fuzz_process is not None:
+            return [
+                all_keys[index] for _match, _score, index in fuzz_process.extract(
+                    target, folded, scorer=fuzz.ratio, processor=None, limit=n, score_cutoff=40
+                )
+            ]
+        matches = difflib.get_close_matches(target, list(by_folded), n=n, cutoff=0.4)
+        return [key for match in matches for key in by_folded[match]][:n]
 
     def check_connection(self) -> bool:
         """
@@ -246,13 +640,28 @@ class Database:
         except Exception:
             return False
 
-    def count_files(self, query: str = None, where: Dict[str, Any] = None) -> int:
+    def warm_up(self):
+        """
+        Run one tiny semantic query so the embedding model and the vector index
+        are loaded before the first real search, not during it.
+        """
+        try:
+            if self.collection.count():
+                self.collection.query(query_texts=["photo"], n_results=1, include=[])
+            self._load_keys()
+        except Exception as e:
+            print(f"Warning: Database warm-up failed: {e}")
+
+    def count_files(self, query: str = None, where: Dict[str, Any] = None, max_scan: int = SEMANTIC_COUNT_LIMIT) -> int:
         """
         Count files matching the criteria.
+        A semantic count (with query) considers at most `max_scan` nearest matches.
         """
         if not query and not where:
             return self.collection.count()
-        
+        return self._cached(("count_files", query, where, max_scan), lambda: self._count_files(query, where, max_scan))
+
+    def _count_files(self, query: str = None, where: Dict[str, Any] = None, max_scan: int = SEMANTIC_COUNT_LIMIT) -> int:
         if query:
             # Semantic search count is tricky because query() returns top N results.
             # We can't easily get a "total count" of semantic matches without retrieving all.
@@ -267,45 +676,75 @@ class Database:
             # But standard DB count usually implies exact matches.
             
             # If the user mixes query (semantic) and where (filter), it's a semantic search.
-            # We'll fetch up to 1000 results and count them.
+            # We'll fetch up to max_scan results (never more than the collection holds) and count them.
+            n_results = min(max_scan, self.collection.count())
+            if n_results <= 0:
+                return 0
             results = self.collection.query(
                 query_texts=[query],
                 where=where,
-                n_results=1000 # Arbitrary limit for "count" in semantic search
+                n_results=n_results,
+                include=[] # Only the IDs are counted
             )
-            return len(results['ids'][0]) if results['ids'] else 0
+            return len(self._unpack_query(results)[0])
             
         else:
             # Exact filtering
-            results = self.collection.get(
-                where=where,
-                include=[] # Don't fetch data, just IDs
-            )
-            return len(results['ids']) if results['ids'] else 0
+            return self._count_where(where)
+
+    def _count_where(self, where: Optional[Dict[str, Any]]) -> int:
+        """
+        Count files matching an exact filter, server-side where Chroma supports
+        count(where=...), otherwise by fetching just the matching IDs.
+        """
+        if not where:
+            return self.collection.count()
+        if self._has_count_where is not False:
+            try:
+                count = self.collection.count(where=where)
+                self._has_count_where = True
+                return count
+            except TypeError:
+                self._has_count_where = False # Not supported by this Chroma version
+        results = self.collection.get(
+            where=where,
+            include=[] # Don't fetch data, just IDs
+        )
+        return len(self._unpack_get(results)[0])
 
     def group_files_by_field(self, field: str, query: str = None, where: Dict[str, Any] = None) -> Dict[str, int]:
         """
         Group files by a specific metadata field and return counts.
         Example: group_files_by_field('Model') -> {'iPhone 12': 10, 'iPhone 13': 5}
         """
+        groups = self._cached(
+            ("group_files_by_field", field, query, where),
+            lambda: self._group_files_by_field(field, query, where)
+        )
+        return dict(groups) # Callers may modify their copy
+
+    def _group_files_by_field(self, field: str, query: str = None, where: Dict[str, Any] = None) -> Dict[str, int]:
         # 1. Fetch results
         if query:
+             n_results = self._semantic_scan_size()
+             if n_results == 0:
+                 return {}
              results = self.collection.query(
                 query_texts=[query],
                 where=where,
-                n_results=2000 
+                n_results=n_results,
+                include=['metadatas']
             )
-             metadatas = results['metadatas'][0] if results['metadatas'] else []
+             metadatas = self._unpack_query(results)[1]
         else:
             # If no query, we can fetch all matching the filter
             results = self.collection.get(
                 where=where,
                 include=['metadatas']
             )
-            metadatas = results['metadatas'] if results['metadatas'] else []
+            metadatas = self._unpack_get(results)[1]
 
         # 2. Group in Python
-        from collections import defaultdict
         groups = defaultdict(int)
         
         for meta in metadatas:
@@ -317,6 +756,41 @@ class Database:
                 
         return dict(groups)
 
+    def _semantic_scan_size(self) -> int:
+        """
+        n_results for a semantic search whose hits are all post-processed:
+        SEMANTIC_SCAN_LIMIT, but never more than the collection holds.
+        """
+        return min(SEMANTIC_SCAN_LIMIT, self.collection.count())
+
+    def _cached(self, key: Tuple, compute: Callable[[], Any]) -> Any:
+        """
+        Return compute(), reusing the result of an identical call made less than
+        RESULT_CACHE_TTL seconds ago. Cleared whenever the database is written.
+        """
+        try:
+            cache_key = orjson.dumps(key, option=orjson.OPT_SORT_KEYS)
+        except (TypeError, ValueError):
+            return compute()
+
+        now = time.monotonic()
+        with self._cache_lock:
+            hit = self._result_cache.get(cache_key)
+            if hit is not None and now - hit[0] < RESULT_CACHE_TTL:
+                return hit[1]
+            generation = self._cache_generation
+
+        value = compute()
+        with self._cache_lock:
+            if generation != self._cache_generation:
+                return value # Written meanwhile: the value may predate the write
+            if len(self._result_cache) >= 256:
+                # Drop expired entries before growing further
+                for k in [k for k, v in self._result_cache.items() if now - v[0] >= RESULT_CACHE_TTL]:
+                    del self._result_cache[k]
+            self._result_cache[cache_key] = (now, value)
+        return value
+
     def get_database_stats(self) -> Dict[str, Any]:
         """
         Get general database statistics.
@@ -344,6 +818,7 @@ class Database:
         Perform a complex query with filtering, sorting, pagination, and projection.
         """
         # 1. Fetch Results
+        from_snapshot = False
         if query:
             # Semantic search
             # We fetch more than limit if we need to sort by a metadata field later
@@ -352,43 +827,39 @@ class Database:
             if sort_by:
                 # If sorting by metadata, we might need to fetch ALL matches to sort correctly
                 # This is a limitation of Chroma + Post-processing.
-                # For now, let's fetch a reasonable large batch (e.g. 1000) or all if possible?
-                # Chroma query doesn't support "all".
-                fetch_limit = 2000 # Arbitrary cap for performance
+                # Chroma query doesn't support "all", so the nearest SEMANTIC_SCAN_LIMIT are sorted.
+                fetch_limit = self._semantic_scan_size()
             
-            results = self.collection.query(
-                query_texts=[query],
-                where=where,
-                n_results=fetch_limit
-            )
-            
-            items = []
-            if results['metadatas'] and len(results['metadatas']) > 0:
-                 for i, meta in enumerate(results['metadatas'][0]):
-                     item = meta.copy()
-                     item['SourceFile'] = results['ids'][0][i]
-                     item['score'] = results['distances'][0][i]
-                     items.append(item)
+            if fetch_limit <= 0:
+                items = []
+            else:
+                results = self.collection.query(
+                    query_texts=[query],
+                    where=where,
+                    n_results=fetch_limit,
+                    include=_QUERY_INCLUDE
+                )
+                items = self._query_rows(results)
         else:
             # Exact filtering
             # If sorting is required, we must fetch ALL to sort in Python
-            if sort_by:
-                results = self.collection.get(where=where) # Fetch all
+            if sort_by and not where:
+                # Reuse the shared snapshot; the page is copied after slicing
+                items = list(self._get_all_cached())
+                from_snapshot = True
             else:
-                # If no sort, we can rely on Chroma's internal order (undefined) + slice
-                # But Chroma .get() supports limit/offset
-                results = self.collection.get(
-                    where=where,
-                    limit=limit,
-                    offset=offset
-                )
-            
-            items = []
-            if results['metadatas']:
-                for i, meta in enumerate(results['metadatas']):
-                    item = meta.copy()
-                    item['SourceFile'] = results['ids'][i]
-                    items.append(item)
+                if sort_by:
+                    results = self.collection.get(where=where, include=_GET_INCLUDE) # Fetch all
+                else:
+                    # If no sort, we can rely on Chroma's internal order (undefined) + slice
+                    # But Chroma .get() supports limit/offset
+                    results = self.collection.get(
+                        where=where,
+                        limit=limit,
+                        offset=offset,
+                        include=_GET_INCLUDE
+                    )
+                items = self._get_rows(results)
 
         # 2. Sort (if needed)
         # Note: If query was present and sort_by is None, items are already sorted by score (distance)
@@ -403,37 +874,19 @@ class Database:
                     return str(val) if val is not None else ""
 
             reverse = (sort_order.lower() == "desc")
-            items.sort(key=get_sort_key, reverse=reverse)
+            # Only the first offset + limit rows can end up on the page
+            items = _sort_top(items, get_sort_key, reverse, keep=offset + limit)
             
-            # Apply pagination AFTER sorting (if we fetched all)
-            # If we used semantic search, we already limited fetch, but we might need to slice again
-            # if we fetched extra for sorting.
-            if query:
-                 # We fetched up to 2000. Now we slice the page.
-                 start = offset
-                 end = offset + limit
-                 items = items[start:end]
-            else:
-                # We fetched ALL for exact filter + sort. Now slice.
-                start = offset
-                end = offset + limit
-                items = items[start:end]
+            # Apply pagination AFTER sorting: we fetched extra (or ALL) rows for sorting
+            items = items[offset:offset + limit]
+            if from_snapshot:
+                items = [dict(item) for item in items]
 
         # 3. Projection
         if projection:
-            projected_items = []
-            for item in items:
-                new_item = {}
-                # Always include SourceFile unless explicitly excluded? 
-                # Usually DBs include ID. Let's include SourceFile.
-                if 'SourceFile' in item:
-                    new_item['SourceFile'] = item['SourceFile']
-                
-                for field in projection:
-                    if field in item:
-                        new_item[field] = item[field]
-                projected_items.append(new_item)
-            items = projected_items
+            # Always include SourceFile: usually DBs include ID.
+            fields = ['SourceFile', *(f for f in dict.fromkeys(projection) if f != 'SourceFile')]
+            items = [{f: item[f] for f in fields if f in item} for item in items]
 
         return items
 
@@ -448,6 +901,8 @@ class Database:
         # Optimization: Check if the first stage is $match to use DB filtering
         first_stage = pipeline[0]
         initial_docs = []
+        match_criteria = None
+        query_text = None
         
         if "$match" in first_stage:
             # Use Chroma to fetch initial set
@@ -457,284 +912,508 @@ class Database:
             # or just standard fields for filter.
             query_text = match_criteria.pop("query", None) if isinstance(match_criteria, dict) else None
             
-            if query_text:
-                # Semantic search
-                results = self.collection.query(
-                    query_texts=[query_text],
-                    where=match_criteria if match_criteria else None,
-                    n_results=2000 # Fetch a reasonable amount for aggregation
-                )
-                if results['metadatas'] and len(results['metadatas']) > 0:
-                     for i, meta in enumerate(results['metadatas'][0]):
-                         item = meta.copy()
-                         item['SourceFile'] = results['ids'][0][i]
-                         item['score'] = results['distances'][0][i]
-                         initial_docs.append(item)
-            else:
-                # Exact filter
-                results = self.collection.get(where=match_criteria)
-                if results['metadatas']:
-                    for i, meta in enumerate(results['metadatas']):
-                        item = meta.copy()
-                        item['SourceFile'] = results['ids'][i]
-                        initial_docs.append(item)
-            
             # Remove the first stage as we've processed it
             pipeline = pipeline[1:]
+
+            # Fold every directly following $match into the same Chroma filter;
+            # whatever Chroma can't evaluate stays behind as in-memory $match stages.
+            leading = [match_criteria]
+            while pipeline and "$match" in pipeline[0]:
+                leading.append(pipeline[0]["$match"])
+                pipeline = pipeline[1:]
+            match_criteria, residual = self._push_down_matches(leading)
+            pipeline = [{"$match": criteria} for criteria in residual] + pipeline
+
+        # Optimization: push a leading run of $skip/$limit down into the fetch
+        offset, limit, pipeline = self._take_window(pipeline)
+
+        if not query_text and len(pipeline) == 1 and len(pipeline[0]) == 1 and "$count" in pipeline[0]:
+            # Count only: no need to fetch the matching rows at all
+            count = max(0, self._count_where(match_criteria) - offset)
+            if limit is not None:
+                count = min(count, limit)
+            return [{pipeline[0]["$count"]: count}]
+
+        fetch = None # Empty window: nothing to fetch
+        if limit == 0:
+            pass
+        elif query_text:
+            # Semantic search
+            if limit is not None:
+                # Results are ranked, so the top page is enough; a deep $skip is
+                # still capped like an unwindowed fetch
+                n_results = min(offset + limit, self._semantic_scan_size())
+            else:
+                n_results = self._semantic_scan_size() # Fetch a reasonable amount for aggregation
+
+            if n_results > 0: # Otherwise the collection is empty
+                def fetch():
+                    results = self.collection.query(
+                        query_texts=[query_text],
+                        where=match_criteria if match_criteria else None,
+                        n_results=n_results,
+                        include=_QUERY_INCLUDE
+                    )
+                    return self._query_rows(results)[offset:]
+        elif limit is None and not match_criteria:
+            # No initial match: fetch all (expensive!), reusing the shared snapshot
+            # (copied, as results leave this method)
+            def fetch():
+                return [dict(row) for row in self._get_all_cached()[offset:]]
         else:
-            # No initial match, fetch all (expensive!)
-            results = self.collection.get()
-            if results['metadatas']:
-                for i, meta in enumerate(results['metadatas']):
-                    item = meta.copy()
-                    item['SourceFile'] = results['ids'][i]
-                    initial_docs.append(item)
+            # Exact filter, or a window pushed down into the fetch
+            def fetch():
+                if limit is not None:
+                    results = self.collection.get(where=match_criteria or None, limit=limit, offset=offset, include=_GET_INCLUDE)
+                    return self._get_rows(results)
+                results = self.collection.get(where=match_criteria, include=_GET_INCLUDE)
+                return self._get_rows(results)[offset:]
 
-        current_docs = initial_docs
+        if fetch is None:
+            return self._run_stages(pipeline, [])
+        # Compile the remaining stages while the fetch is in flight
+        pending = _FETCH_EXECUTOR.submit(fetch)
+        run = self._pipeline_runner(pipeline)
+        return run(pending.result())
 
+    def _run_stages(self, pipeline: List[Dict[str, Any]], docs: List[Dict]) -> List[Dict]:
+        """
+        Run in-memory pipeline stages over `docs`.
+        """
+        return self._pipeline_runner(pipeline)(docs)
+
+    def _pipeline_runner(self, pipeline: List[Dict[str, Any]]) -> Callable[[List[Dict]], List[Dict]]:
+        """
+        Compiled runner for `pipeline`, reused for pipelines seen before.
+        """
+        try:
+            # Stage and key order are meaningful, so the key keeps them as given.
+            pipeline_key = orjson.dumps(pipeline)
+        except (TypeError, ValueError):
+            return self._build_pipeline(pipeline)
+        return self._compile_pipeline(pipeline_key)
+
+    def _compile_pipeline(self, pipeline_key: bytes) -> Callable[[List[Dict]], List[Dict]]:
+        """
+        Compile a pipeline given as JSON. Wrapped in a per-instance LRU cache in __init__.
+        """
+        return self._build_pipeline(orjson.loads(pipeline_key))
+
+    def _build_pipeline(self, pipeline: List[Dict[str, Any]]) -> Callable[[List[Dict]], List[Dict]]:
+        """
+        Resolve every stage to a docs -> docs callable once, so running the
+        pipeline does no stage or operator dispatch.
+        """
+        steps = []
+        for i, stage in enumerate(pipeline):
+            if "$sort" in stage:
+                # A $sort followed by $skip/$limit only needs its first skip + limit docs
+                offset, limit, _ = self._take_window(pipeline[i + 1:])
+                keep = offset + limit if limit is not None else None
+                steps.append(self._compile_sort(stage["$sort"], keep))
+            else:
+                steps.append(self._compile_stage(stage))
+
+        def run(docs: List[Dict]) -> List[Dict]:
+            for step in steps:
+                docs = step(docs)
+            return docs
+        return run
+
+    def _compile_stage(self, stage: Dict[str, Any]) -> Callable[[List[Dict]], List[Dict]]:
+        """
+        Resolve one pipeline stage to a docs -> docs callable.
+        """
+        if "$match" in stage:
+            return self._compile_match(stage["$match"])
+        elif "$group" in stage:
+            return self._compile_group(stage["$group"])
+        elif "$sort" in stage:
+            return self._compile_sort(stage["$sort"])
+        elif "$project" in stage:
+            return self._compile_project(stage["$project"])
+        elif "$limit" in stage:
+            limit = stage["$limit"]
+            return lambda docs: docs[:limit]
+        elif "$skip" in stage:
+            skip = stage["$skip"]
+            return lambda docs: docs[skip:]
+        elif "$count" in stage:
+            count_field = stage["$count"]
+            return lambda docs: [{count_field: len(docs)}]
+        return lambda docs: docs # Unknown stages are ignored
+
+    def _push_down_matches(self, criteria_list: List[Any]) -> Tuple[Optional[Dict[str, Any]], List[Any]]:
+        """
+        Combine $match criteria into one Chroma where clause.
+        Returns (where or None, criteria that must still be applied in memory).
+        The first criteria were always evaluated by Chroma; later ones were
+        applied in memory, so they are only pushed down where Chroma gives
+        the same answer.
+        """
+        clauses = []
+        residual = []
+        for i, criteria in enumerate(criteria_list):
+            if not criteria:
+                continue
+            where = self._translate_to_chroma_where(criteria, exact=i > 0)
+            if where is None:
+                residual.append(criteria)
+            elif list(where) == ["$and"]:
+                clauses.extend(where["$and"])
+            else:
+                clauses.append(where)
+
+        if not clauses:
+            return None, residual
+        return (clauses[0] if len(clauses) == 1 else {"$and": clauses}), residual
+
+    def _translate_to_chroma_where(self, criteria: Any, exact: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Rewrite $match criteria in Chroma's where dialect (implicit ANDs made
+        explicit), or return None if any part of them can't be evaluated by
+        Chroma and so must be applied in memory. See _chroma_supports for `exact`.
+        """
+        if not isinstance(criteria, dict):
+            return None
+
+        clauses = []
+        for key, value in criteria.items():
+            if key in ("$and", "$or"):
+                if not isinstance(value, list) or not value:
+                    return None
+                subs = [self._translate_to_chroma_where(sub, exact) for sub in value]
+                if any(sub is None for sub in subs):
+                    return None
+                clauses.append(subs[0] if len(subs) == 1 else {key: subs})
+            elif key.startswith("$") or key == "score":
+                return None # Unknown operator, or a field that only exists after a semantic query
+            elif isinstance(value, dict):
+                if not value:
+                    return None
+                for op, op_val in value.items():
+                    if not _chroma_supports(op, op_val, exact):
+                        return None
+                    clauses.append({key: {op: op_val}})
+            elif _chroma_supports("$eq", value, exact):
+                clauses.append({key: value})
+            else:
+                return None
+
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def _take_window(self, pipeline: List[Dict[str, Any]]) -> Tuple[int, Optional[int], List[Dict[str, Any]]]:
+        """
+        Fold the leading run of $skip/$limit stages into a single (offset, limit)
+        window so it can be applied by the fetch itself.
+        Returns (offset, limit or None, remaining pipeline).
+        """
+        offset, limit = 0, None
+        consumed = 0
         for stage in pipeline:
-            if "$match" in stage:
-                current_docs = self._stage_match(current_docs, stage["$match"])
-            elif "$group" in stage:
-                current_docs = self._stage_group(current_docs, stage["$group"])
-            elif "$sort" in stage:
-                current_docs = self._stage_sort(current_docs, stage["$sort"])
-            elif "$project" in stage:
-                current_docs = self._stage_project(current_docs, stage["$project"])
-            elif "$limit" in stage:
-                limit = stage["$limit"]
-                current_docs = current_docs[:limit]
-            elif "$skip" in stage:
+            if "$skip" in stage:
                 skip = stage["$skip"]
-                current_docs = current_docs[skip:]
-            elif "$count" in stage:
-                count_field = stage["$count"]
-                current_docs = [{count_field: len(current_docs)}]
-
-        return current_docs
+                offset += skip
+                if limit is not None:
+                    limit = max(0, limit - skip)
+            elif "$limit" in stage:
+                limit = stage["$limit"] if limit is None else min(limit, stage["$limit"])
+            else:
+                break
+            consumed += 1
+        return offset, limit, pipeline[consumed:]
 
     def _stage_match(self, docs: List[Dict], criteria: Dict) -> List[Dict]:
         """
         Filter documents in memory.
         Supports simple equality and some operators ($gt, $lt, $in).
         """
-        filtered = []
-        for doc in docs:
-            match = True
-            for key, value in criteria.items():
-                if key == "$or":
-                    # Handle OR logic
-                    if not any(self._check_condition(doc, sub_criteria) for sub_criteria in value):
-                        match = False
-                        break
-                elif key == "$and":
-                    if not all(self._check_condition(doc, sub_criteria) for sub_criteria in value):
-                        match = False
-                        break
-                else:
-                    # Standard field check
-                    if not self._check_condition(doc, {key: value}):
-                        match = False
-                        break
-            if match:
-                filtered.append(doc)
-        return filtered
+        return self._compile_match(criteria)(docs)
 
-    def _check_condition(self, doc: Dict, condition: Dict) -> bool:
+    def _compile_match(self, criteria: Dict) -> Callable[[List[Dict]], List[Dict]]:
+        """
+        Compile $match criteria into a filter. Conditions are applied column-wise:
+        each one runs as a single pass over the documents that survived the
+        previous ones.
         """
-        Check if a document satisfies a single condition (key: value or key: {op: value}).
+        steps = []
+        for key, value in criteria.items():
+            if key == "$or":
+                steps.append(self._compile_any([self._compile_condition(sub) for sub in value]))
+            elif key == "$and":
+                for sub_criteria in value:
+                    steps.extend(self._compile_condition(sub_criteria))
+            else:
+                # Standard field check
+                steps.extend(self._compile_condition({key: value}))
+
+        def run(docs: List[Dict]) -> List[Dict]:
+            for step in steps:
+                docs = step(docs)
+            return docs
+        return run
+
+    def _compile_any(self, branches: List[List[Callable]]) -> Callable[[List[Dict]], List[Dict]]:
+        """
+        Keep documents matching at least one branch, preserving order.
+        Each branch only sees documents no earlier branch matched.
+        """
+        def run(docs: List[Dict]) -> List[Dict]:
+            matched = set()
+            remaining = docs
+            for steps in branches:
+                if not remaining:
+                    break
+                hits = remaining
+                for step in steps:
+                    hits = step(hits)
+                matched.update(map(id, hits))
+                remaining = [doc for doc in remaining if id(doc) not in matched]
+            return [doc for doc in docs if id(doc) in matched]
+        return run
+
+    def _compile_condition(self, condition: Dict) -> List[Callable[[List[Dict]], List[Dict]]]:
         """
+        Compile a single condition (key: value or key: {op: value}) into filter steps.
+        """
+        steps = []
         for key, expected in condition.items():
-            actual = doc.get(key)
-            
             if isinstance(expected, dict):
                 # Operator check
                 for op, op_val in expected.items():
-                    if op == "$gt":
-                        if not (actual is not None and actual > op_val): return False
-                    elif op == "$gte":
-                        if not (actual is not None and actual >= op_val): return False
-                    elif op == "$lt":
-                        if not (actual is not None and actual < op_val): return False
-                    elif op == "$lte":
-                        if not (actual is not None and actual <= op_val): return False
-                    elif op == "$ne":
-                        if actual == op_val: return False
-                    elif op == "$in":
-                        if actual not in op_val: return False
-                    elif op == "$nin":
-                        if actual in op_val: return False
+                    step = self._compile_operator(key, op, op_val)
+                    if step is not None:
+                        steps.append(step)
             else:
                 # Equality check
-                if actual != expected:
-                    return False
-        return True
+                steps.append(lambda docs, key=key, expected=expected: [d for d in docs if d.get(key) == expected])
+        return steps
+
+    def _compile_operator(self, key: str, op: str, value: Any) -> Optional[Callable[[List[Dict]], List[Dict]]]:
+        """
+        Filter step for `key: {op: value}`, with the comparison resolved up front.
+        """
+        compare = _RANGE_OPS.get(op)
+        if compare is not None:
+            return lambda docs: [d for d in docs if (actual := d.get(key)) is not None and compare(actual, value)]
+        if op == "$eq":
+            return lambda docs: [d for d in docs if d.get(key) == value]
+        if op == "$ne":
+            return lambda docs: [d for d in docs if d.get(key) != value]
+        if op == "$in":
+            return lambda docs: [d for d in docs if d.get(key) in value]
+        if op == "$nin":
+            return lambda docs: [d for d in docs if d.get(key) not in value]
+        return None # Unknown operators are ignored
 
     def _stage_group(self, docs: List[Dict], spec: Dict) -> List[Dict]:
         """
         Group documents.
         spec: { "_id": "$Field", "count": { "$sum": 1 }, ... }
         """
-        from collections import defaultdict
-        
+        return self._compile_group(spec)(docs)
+
+    def _compile_group(self, spec: Dict) -> Callable[[List[Dict]], List[Dict]]:
+        """
+        Compile a $group spec. Accumulators are resolved once, and documents are
+        folded into per-group running totals in a single pass: each numeric
+        target field is converted once per document and shared by every
+        $sum/$avg/$min/$max reading it.
+        """
         id_expr = spec.get("_id")
-        groups = defaultdict(list)
-        
-        # 1. Grouping
-        for doc in docs:
-            # Resolve _id value
-            if id_expr and isinstance(id_expr, str) and id_expr.startswith("$"):
-                field = id_expr[1:]
-                group_key = doc.get(field)
-            else:
-                group_key = id_expr # Constant or None
-            
-            # Convert list/dict keys to string to be hashable
-            if isinstance(group_key, (list, dict)):
-                group_key = str(group_key)
-                
-            groups[group_key].append(doc)
-            
-        # 2. Accumulation
-        output = []
-        for key, group_docs in groups.items():
-            result_doc = {"_id": key}
-            
-            for field, accumulator in spec.items():
-                if field == "_id":
+        id_field = id_expr[1:] if isinstance(id_expr, str) and id_expr.startswith("$") else None
+
+        # (output field, op, numeric slot / pushed field / first field / $sum constant)
+        ops = []
+        numeric_fields = []
+        push_fields = []
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            # accumulator is like {"$sum": 1} or {"$avg": "$Age"}
+            for op, op_val in accumulator.items():
+                if op == "$sum" and isinstance(op_val, (int, float)):
+                    # Constant: {"$sum": 1} counts documents, {"$sum": n} adds n per document
+                    ops.append((field, "$count", op_val))
                     continue
-                
-                # accumulator is like {"$sum": 1} or {"$avg": "$Age"}
-                for op, op_val in accumulator.items():
-                    if op == "$sum":
-                        if op_val == 1:
-                            result_doc[field] = len(group_docs)
-                        elif isinstance(op_val, str) and op_val.startswith("$"):
-                            # Sum a field
-                            target_field = op_val[1:]
-                            # Try to convert to float for sum
-                            total = 0
-                            for d in group_docs:
-                                val = d.get(target_field)
-                                try:
-                                    total += float(val)
-                                except (ValueError, TypeError):
-                                    continue
-                            result_doc[field] = total
+                if not (isinstance(op_val, str) and op_val.startswith("$")):
+                    continue
+                target_field = op_val[1:]
+                if op in ("$sum", "$avg", "$min", "$max"):
+                    if target_field not in numeric_fields:
+                        numeric_fields.append(target_field)
+                    ops.append((field, op, numeric_fields.index(target_field)))
+                elif op == "$push":
+                    if target_field not in push_fields:
+                        push_fields.append(target_field)
+                    ops.append((field, op, push_fields.index(target_field)))
+                elif op == "$first":
+                    ops.append((field, op, target_field))
+
+        def run(docs: List[Dict]) -> List[Dict]:
+            # group key -> [doc count, [[sum, n, min, max] per numeric field], [values per pushed field], first doc]
+            groups = {}
+
+            # 1. Grouping and accumulation
+            for doc in docs:
+                group_key = doc.get(id_field) if id_field is not None else id_expr # Field or constant
+                # Convert list/dict keys to string to be hashable
+                if isinstance(group_key, (list, dict)):
+                    group_key = str(group_key)
+
+                state = groups.get(group_key)
+                if state is None:
+                    state = groups[group_key] = [
+                        0, [[0, 0, None, None] for _ in numeric_fields], [[] for _ in push_fields], doc
+                    ]
+                state[0] += 1
+
+                for stats, target_field in zip(state[1], numeric_fields):
+                    try:
+                        val = float(doc.get(target_field))
+                    except (ValueError, TypeError):
+                        continue
+                    stats[0] += val
+                    stats[1] += 1
+                    if stats[2] is None or val < stats[2]:
+                        stats[2] = val
+                    if stats[3] is None or val > stats[3]:
+                        stats[3] = val
+
+                for values, target_field in zip(state[2], push_fields):
+                    values.append(doc.get(target_field))
+
+            # 2. Emit
+            output = []
+            for group_key, (count, numeric, pushed, first_doc) in groups.items():
+                result_doc = {"_id": group_key}
+                for field, op, slot in ops:
+                    if op == "$count":
+                        result_doc[field] = count * slot
+                    elif op == "$sum":
+                        result_doc[field] = numeric[slot][0]
                     elif op == "$avg":
-                        if isinstance(op_val, str) and op_val.startswith("$"):
-                            target_field = op_val[1:]
-                            values = []
-                            for d in group_docs:
-                                val = d.get(target_field)
-                                try:
-                                    values.append(float(val))
-                                except (ValueError, TypeError):
-                                    continue
-                            result_doc[field] = sum(values) / len(values) if values else 0
+                        total, n = numeric[slot][0], numeric[slot][1]
+                        result_doc[field] = total / n if n else 0
                     elif op == "$min":
-                        if isinstance(op_val, str) and op_val.startswith("$"):
-                            target_field = op_val[1:]
-                            values = []
-                            for d in group_docs:
-                                val = d.get(target_field)
-                                try:
-                                    values.append(float(val))
-                                except (ValueError, TypeError):
-                                    continue
-                            result_doc[field] = min(values) if values else None
+                        result_doc[field] = numeric[slot][2]
                     elif op == "$max":
-                        if isinstance(op_val, str) and op_val.startswith("$"):
-                            target_field = op_val[1:]
-                            values = []
-                            for d in group_docs:
-                                val = d.get(target_field)
-                                try:
-                                    values.append(float(val))
-                                except (ValueError, TypeError):
-                                    continue
-                            result_doc[field] = max(values) if values else None
+                        result_doc[field] = numeric[slot][3]
                     elif op == "$push":
-                        if isinstance(op_val, str) and op_val.startswith("$"):
-                            target_field = op_val[1:]
-                            result_doc[field] = [d.get(target_field) for d in group_docs]
+                        result_doc[field] = list(pushed[slot])
                     elif op == "$first":
-                         if isinstance(op_val, str) and op_val.startswith("$"):
-                            target_field = op_val[1:]
-                            result_doc[field] = group_docs[0].get(target_field) if group_docs else None
-            
-            output.append(result_doc)
-            
-        return output
+                        result_doc[field] = first_doc.get(slot)
+                output.append(result_doc)
+
+            return output
+        return run
 
     def _stage_sort(self, docs: List[Dict], spec: Dict) -> List[Dict]:
         """
         Sort documents.
         spec: { "Field": 1 } or { "Field": -1 }
         """
-        # Python's sort is stable, so we can sort by multiple keys by sorting in reverse order of keys
-        # But for simplicity, let's handle single key sort or simple multi-key
-        
-        # Convert spec to list of (key, direction)
-        sort_keys = []
-        for k, v in spec.items():
-            sort_keys.append((k, v))
-            
-        # Sort
-        # We'll use a custom key function
-        def get_sort_key(item):
-            values = []
-            for k, _ in sort_keys:
-                val = item.get(k)
-                # Normalize for comparison (None is smallest)
-                if val is None:
-                    values.append((0, "")) # Type 0 for None
-                elif isinstance(val, (int, float)):
-                    values.append((1, val)) # Type 1 for numbers
-                else:
-                    values.append((2, str(val))) # Type 2 for strings
-            return tuple(values)
+        return self._compile_sort(spec)(docs)
 
-        # Since Python sort key doesn't support mixed directions easily in one pass for complex types,
-        # we will do a simple single-key sort or assume all same direction if we want to be lazy.
-        # BUT, to do it right:
-        # We can sort repeatedly.
-        
-        for k, direction in reversed(sort_keys):
-            reverse = (direction == -1 or direction == "desc")
-            docs.sort(key=lambda x: x.get(k) if x.get(k) is not None else "", reverse=reverse)
-            
-        return docs
+    def _compile_sort(self, spec: Dict, keep: Optional[int] = None) -> Callable[[List[Dict]], List[Dict]]:
+        """
+        Compile a $sort spec into a single stable sort on typed keys, so mixed
+        value types (None, numbers, strings) order consistently instead of
+        raising TypeError. With `keep`, only the first `keep` docs are returned.
+        """
+        fields = list(spec)
+        directions = [-1 if v == -1 or v == "desc" else 1 for v in spec.values()]
+
+        def key(doc: Dict) -> Tuple:
+            return tuple(_typed_sort_key(doc.get(k)) for k in fields)
+
+        if len(set(directions)) <= 1:
+            # One direction for every key: a plain tuple-key sort
+            reverse = directions == [-1] * len(directions)
+
+            def run(docs: List[Dict]) -> List[Dict]:
+                return _sort_top(docs, key, reverse, keep)
+            return run
+
+        # Mixed directions: compare the precomputed key columns with a per-column sign
+        def compare(a: Tuple, b: Tuple) -> int:
+            for x, y, direction in zip(a[0], b[0], directions):
+                if x != y:
+                    return direction if x > y else -direction
+            return 0
+
+        def run(docs: List[Dict]) -> List[Dict]:
+            decorated = [(key(doc), doc) for doc in docs]
+            decorated = _sort_top(decorated, functools.cmp_to_key(compare), keep=keep)
+            return [doc for _, doc in decorated]
+        return run
 
     def _stage_project(self, docs: List[Dict], spec: Dict) -> List[Dict]:
         """
         Project fields.
         spec: { "Field": 1, "Other": 0 }
         """
-        projected = []
-        
+        return self._compile_project(spec)(docs)
+
+    def _compile_project(self, spec: Dict) -> Callable[[List[Dict]], List[Dict]]:
+        """
+        Compile a $project spec: the kept (or dropped) fields are resolved once,
+        and each document is rebuilt with a single comprehension.
+        """
+        # Fields copied from another field: { "NewName": "$OldName" }
+        renamed = [(k, v[1:]) for k, v in spec.items() if isinstance(v, str) and v.startswith("$")]
+
         # Check if it's an inclusion or exclusion projection
         # Mixed is not allowed in Mongo usually, except for _id.
-        # We'll assume inclusion if any field is 1.
-        is_inclusion = any(v == 1 or v is True for k, v in spec.items() if k != "_id")
-        
-        for doc in docs:
-            new_doc = {}
-            if is_inclusion:
-                # Inclusion mode: start empty, add specified
-                # _id is included by default unless excluded
-                if spec.get("_id") != 0 and "_id" in doc:
-                    new_doc["_id"] = doc["_id"]
-                    
-                for k, v in spec.items():
-                    if (v == 1 or v is True) and k in doc:
-                        new_doc[k] = doc[k]
-            else:
-                # Exclusion mode: start with all, remove specified
-                new_doc = doc.copy()
-                for k, v in spec.items():
-                    if (v == 0 or v is False) and k in new_doc:
-                        del new_doc[k]
-            projected.append(new_doc)
-            
-        return projected
+        # We'll assume inclusion if any field is 1 or renamed.
+        is_inclusion = bool(renamed) or any(v == 1 or v is True for k, v in spec.items() if k != "_id")
+
+        if is_inclusion:
+            # Inclusion mode: only the specified fields
+            # _id is included by default unless excluded or renamed
+            fields = [k for k, v in spec.items() if k != "_id" and (v == 1 or v is True)]
+            if spec.get("_id") not in (0, False) and all(k != "_id" for k, _ in renamed):
+                fields.insert(0, "_id")
+            if not renamed:
+                return lambda docs: [{k: doc[k] for k in fields if k in doc} for doc in docs]
+            return lambda docs: [
+                {**{k: doc[k] for k in fields if k in doc},
+                 **{k: doc[src] for k, src in renamed if src in doc}}
+                for doc in docs
+            ]
+
+        # Exclusion mode: everything but the specified fields
+        excluded = frozenset(k for k, v in spec.items() if v == 0 or v is False)
+        return lambda docs: [{k: v for k, v in doc.items() if k not in excluded} for doc in docs]
+
+
+class AsyncDatabase:
+    """
+    Awaitable facade over a Database for use inside an event loop (e.g. async
+    MCP tools). Each read runs in a worker thread, so concurrent tool calls
+    overlap their Chroma and Python-side work instead of blocking the loop.
+    """
+    def __init__(self, db: Database):
+        self.db = db
+
+    async def query_files(self, query: str = None, where: Dict[str, Any] = None, n_results: int = 10,
+                          projection: List[str] = None) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.db.query_files, query=query, where=where, n_results=n_results,
+                                       projection=projection)
+
+    async def count_files(self, query: str = None, where: Dict[str, Any] = None, max_scan: int = SEMANTIC_COUNT_LIMIT) -> int:
+        return await asyncio.to_thread(self.db.count_files, query=query, where=where, max_scan=max_scan)
+
+    async def group_files_by_field(self, field: str, query: str = None, where: Dict[str, Any] = None) -> Dict[str, int]:
+        return await asyncio.to_thread(self.db.group_files_by_field, field=field, query=query, where=where)
+
+    async def get_database_stats(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.db.get_database_stats)
+
+    async def advanced_query(self, **kwargs) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.db.advanced_query, **kwargs)
+
+    async def aggregate(self, pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.db.aggregate, pipeline)
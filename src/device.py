@@ -1,68 +1,107 @@
+import concurrent.futures
 import subprocess
 import json
 import os
-import xml.etree.ElementTree as ET
-from typing import Tuple, List, Dict, Any, Optional
+import threading
+import contextlib
+from typing import Tuple, List, Dict, Any, Optional, Iterator
 import exiftool
 
+try:
+    # libxml2-backed parser: faster than the stdlib builder. Dropping blank
+    # text avoids emitting whitespace-only nodes we would discard anyway.
+    from lxml import etree as ET
+    _ITERPARSE_OPTIONS = {"remove_blank_text": True, "resolve_entities": False, "huge_tree": False}
+except ImportError:
+    import xml.etree.ElementTree as ET
+    _ITERPARSE_OPTIONS = {}
+
 def run_cmd(cmd: list) -> Tuple[int, str, str]:
     """
     Run a shell command and return (exit_code, stdout, stderr).
     """
     try:
+        # Capture raw bytes and decode once; undecodable bytes from device
+        # tools become U+FFFD instead of failing the whole command.
         p = subprocess.run(
             cmd,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
+            stderr=subprocess.PIPE
+        )
+        return (
+            p.returncode,
+            p.stdout.strip().decode("utf-8", "replace"),
+            p.stderr.strip().decode("utf-8", "replace"),
         )
-        return p.returncode, p.stdout.strip(), p.stderr.strip()
     except Exception as e:
         return -1, "", str(e)
 
 def get_devices() -> Tuple[int, str, str]:
     return run_cmd(["idevice_id", "-l"])
 
-def parse_plist(elem: ET.Element) -> Any:
-    tag = elem.tag
-
-    if tag == "dict":
-        items = list(elem)
-        result = {}
-        i = 0
-        while i < len(items):
-            key = items[i].text
-            value = parse_plist(items[i + 1])
-            result[key] = value
-            i += 2
-        return result
-
-    if tag == "array":
-        return [parse_plist(child) for child in elem]
-
-    if tag == "string":
-        return elem.text or ""
+# Leaf plist tags -> converter applied to the element text. Containers
+# (dict/array) are handled by load_plist. Numeric tags map straight to the
+# int/float builtins so the common case runs without a Python-level frame.
+_SCALAR_CONVERTERS = {
+    "string": lambda text: text or "",
+    "integer": int,
+    "real": float,
+    "true": lambda text: True,
+    "false": lambda text: False,
+    "data": lambda text: (text or "").strip(),
+    # Kept as the ISO 8601 text rather than a datetime, like <data> stays base64:
+    # device info is returned as JSON.
+    "date": lambda text: text or "",
+}
 
-    if tag == "integer":
-        return int(elem.text)
+def load_plist(source: Any) -> Any:
+    """
+    Parse plist XML from a binary file-like object into native Python values.
+    Values are built straight from parser events and each element is cleared
+    once consumed, so the full DOM is never held alongside the result.
+    """
+    # Hot loop: bind lookups to locals and keep the innermost open container
+    # (and its pending dict key) in plain variables rather than on the stack.
+    get_converter = _SCALAR_CONVERTERS.get
+    stack = []
+    push, pop = stack.append, stack.pop
+    container, key = None, None
+    result = None
 
-    if tag == "real":
-        return float(elem.text)
+    for event, elem in ET.iterparse(source, events=("start", "end"), **_ITERPARSE_OPTIONS):
+        tag = elem.tag
 
-    if tag == "true":
-        return True
+        if event == "start":
+            if tag == "dict" or tag == "array":
+                push((container, key))
+                container, key = ({} if tag == "dict" else []), None
+            continue
 
-    if tag == "false":
-        return False
+        if tag == "key":
+            key = elem.text
+            elem.clear()
+            continue
 
-    if tag == "data":
-        return (elem.text or "").strip()
+        if tag == "dict" or tag == "array":
+            value = container
+            container, key = pop()
+        elif tag == "plist":
+            continue
+        else:
+            convert = get_converter(tag)
+            value = convert(elem.text) if convert else None
+        elem.clear()
 
-    return None
+        if container is None:
+            result = value
+        elif type(container) is dict:
+            container[key] = value
+        else:
+            container.append(value)
 
-    return None
+    return result
 
-PII_FIELDS = {
+PII_FIELDS = frozenset({
     "UniqueDeviceID",
     "SerialNumber",
     "WiFiAddress",
@@ -98,7 +137,7 @@ PII_FIELDS = {
     "BasebandChipID",
     "CertID",
     "ChipID"
-}
+})
 
 def mask_pii(data: Any) -> Any:
     """
@@ -120,30 +159,103 @@ def mask_pii(data: Any) -> Any:
     else:
         return data
 
+def _mask_pii_in_place(data: Any) -> Any:
+    """
+    Mask PII fields like mask_pii, but by mutating `data` in place with an
+    iterative walk. For freshly parsed values nobody else holds, this avoids
+    copying every dict and list. Returns `data`.
+    """
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in PII_FIELDS:
+                    node[key] = "REDACTED" # Replacing a value doesn't disturb iteration
+                elif isinstance(value, (dict, list)):
+                    stack.append(value)
+        elif isinstance(node, list):
+            stack.extend(item for item in node if isinstance(item, (dict, list)))
+    return data
+
+class _PrefixedStream:
+    """
+    Minimal binary file-like that returns `head` before the rest of `stream`.
+    Lets us peek past a non-XML preamble without buffering the whole output.
+    """
+    def __init__(self, head: bytes, stream: Any):
+        self._head = head
+        self._stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._head:
+            return self._stream.read(size)
+        if size is None or size < 0:
+            data = self._head + self._stream.read()
+            self._head = b""
+            return data
+        data, self._head = self._head[:size], self._head[size:]
+        return data
+
+def _skip_preamble(stream: Any) -> _PrefixedStream:
+    """
+    Drop any non-XML preamble (e.g. "Return code: 0") from a binary stream.
+    Finds the "<?xml" declaration by byte offset instead of splitting lines.
+    """
+    buf = b""
+    while True:
+        chunk = stream.read(4096)
+        if not chunk:
+            break
+        buf += chunk
+        i = buf.find(b"<?xml")
+        if i >= 0:
+            return _PrefixedStream(buf[i:], stream)
+
+    # No declaration: start at the first tag and let the parser judge the rest.
+    i = buf.find(b"<")
+    return _PrefixedStream(buf[i:] if i > 0 else buf, stream)
+
 def get_device_info(udid: str) -> Tuple[int, Dict[str, Any], str]:
-    rc, xml_string, err = run_cmd(["ideviceinfo", "-u", udid, "-x"])
+    # Parse straight from the pipe so parsing overlaps with ideviceinfo writing
+    # its output, instead of buffering and decoding the whole plist first.
+    try:
+        p = subprocess.Popen(
+            ["ideviceinfo", "-u", udid, "-x"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+    except Exception as e:
+        return -1, {}, str(e)
+
+    with p:
+        # Drain stderr alongside stdout: if ideviceinfo filled the stderr pipe
+        # while we were still reading stdout, both sides would block forever.
+        err_chunks = []
+        err_reader = threading.Thread(target=lambda: err_chunks.append(p.stderr.read()), daemon=True)
+        err_reader.start()
+
+        try:
+            plist_dict = load_plist(_skip_preamble(p.stdout))
+            parse_error = None
+        except Exception as e:
+            plist_dict, parse_error = {}, e
+
+        # Drain anything left so the child can exit, then collect status.
+        p.stdout.read()
+        err_reader.join()
+        err = b"".join(err_chunks).decode("utf-8", "replace").strip()
+        rc = p.wait()
+
     if rc != 0:
         return rc, {}, err
-        
-    xml_string = xml_string.strip()
-    if not xml_string.startswith("<?xml"):
-        xml_string = xml_string.splitlines()
-        xml_string = "\n".join(line for line in xml_string if line.strip().startswith("<"))
+    if parse_error is not None:
+        return -1, {}, f"Failed to parse plist: {parse_error}"
 
-    try:
-        root = ET.fromstring(xml_string)
-        # Apple's plist XML usually has <plist> then <dict>
-        if root.tag == 'plist':
-            plist_dict = parse_plist(root[0])
-        else:
-            plist_dict = parse_plist(root)
-            
-        # Mask PII
-        plist_dict = mask_pii(plist_dict)
-        
-        return rc, plist_dict, err
-    except Exception as e:
-        return -1, {}, f"Failed to parse plist: {e}"
+    # Mask PII (in place: the parsed plist is ours alone)
+    plist_dict = _mask_pii_in_place(plist_dict)
+
+    return rc, plist_dict, err
 
 def mount_device(mount_point: str) -> Tuple[bool, str]:
     
@@ -179,68 +291,194 @@ def unmount_device(mount_point: str) -> Tuple[bool, str]:
             return True, "Unmount Success (diskutil)"
         return False, f"Unmount Failed: {err}"
 
-def process_chunk(chunk: List[str]) -> List[Dict[str, Any]]:
+# Arguments every ExifTool process is started with. "-G -n" are ExifToolHelper's
+# defaults (group-prefixed keys, raw numeric values). "-fast" stops ExifTool
+# scanning to the end of JPEGs for trailers. "-fast2" is deliberately not used:
+# it also skips MakerNotes, which we index and expose as searchable metadata.
+EXIFTOOL_ARGS = ["-G", "-n", "-fast"]
+
+def process_chunk(chunk: List[str], et: Optional[Any] = None) -> List[Dict[str, Any]]:
     """
     Helper to process a single chunk of files with ExifTool.
+    Reuses `et` (an already running ExifToolHelper) when given,
+    otherwise starts a one-off ExifTool process for the chunk.
     """
     try:
-        with exiftool.ExifToolHelper(check_execute=False) as et:
+        if et is not None:
+            return et.get_metadata(chunk)
+        with exiftool.ExifToolHelper(check_execute=False, common_args=EXIFTOOL_ARGS) as et:
             return et.get_metadata(chunk)
     except Exception as e:
         print(f"Error processing chunk: {e}")
         return []
 
-def scan_photos(mount_point: str, existing_files: set = None, callback: Optional[Any] = None, max_workers: int = 4) -> List[Dict[str, Any]]:
+# Extensions handed to ExifTool. Sidecars (.AAE, .THM), .DS_Store and other
+# junk are dropped during the walk so ExifTool never has to open them.
+MEDIA_EXTENSIONS = frozenset({
+    ".jpg", ".jpeg", ".heic", ".heif", ".png", ".dng",
+    ".cr2", ".nef", ".arw", ".mov", ".mp4",
+})
+
+def _iter_media_entries(path: str) -> Iterator[os.DirEntry]:
+    """
+    Recursively yield DirEntry objects for media files under `path`.
+    Uses os.scandir so the file type comes from the directory read itself
+    rather than a separate stat per entry (expensive over ifuse).
+    """
+    try:
+        it = os.scandir(path)
+    except OSError as e:
+        # os.walk silently skipped unreadable directories; keep that behaviour.
+        print(f"Skipping {path}: {e}")
+        return
+
+    with it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_media_entries(entry.path)
+                continue
+            # Lower-case only the extension, not the whole name. Like splitext,
+            # a dot leading the name (".DS_Store") doesn't start an extension.
+            name = entry.name
+            dot = name.rfind(".")
+            if dot > 0 and name[dot:].lower() in MEDIA_EXTENSIONS:
+                yield entry
+
+def _iter_media_paths(path: str, existing_files: Optional[Any],
+                      file_signatures: Optional[Dict[str, Tuple[int, int]]] = None) -> Iterator[str]:
+    """
+    Yield paths of media files under `path` that need (re)processing, as the
+    walk finds them.
+
+    `existing_files` is either a set of paths to skip, or a map of
+    path -> (mtime_ns, size) as recorded at index time; mapped files are only
+    skipped while that signature still matches (None means "unknown, skip").
+    Signatures of files to be (re)processed are recorded in `file_signatures`.
+    """
+    is_map = isinstance(existing_files, dict)
+
+    for entry in _iter_media_entries(path):
+        file_path = entry.path
+        recorded = None
+        # Optimization: Skip if already in DB
+        if existing_files and file_path in existing_files:
+            recorded = existing_files[file_path] if is_map else None
+            if recorded is None:
+                continue
+
+        if recorded is not None or file_signatures is not None:
+            # DirEntry.stat() reuses the entry from the directory read where the
+            # platform allows, instead of a fresh os.stat() lookup by path.
+            st = entry.stat(follow_symlinks=False)
+            signature = (st.st_mtime_ns, st.st_size)
+            if signature == recorded:
+                continue # Unchanged since it was indexed
+            if file_signatures is not None:
+                file_signatures[file_path] = signature
+        yield file_path
+
+def scan_photos(mount_point: str, existing_files: Optional[Any] = None, callback: Optional[Any] = None, max_workers: Optional[int] = None,
+                file_signatures: Optional[Dict[str, Tuple[int, int]]] = None) -> List[Dict[str, Any]]:
     """
     Scans for photos and extracts metadata.
     
     Args:
         mount_point: Path to the mounted device.
-        existing_files: Set of file paths to skip.
+        existing_files: Set of file paths to skip, or a map of path -> (mtime_ns, size)
+                        so files modified since they were indexed are scanned again.
         callback: Optional function to call with each chunk of metadata (List[Dict]).
+                  Exceptions it raises abort the scan and propagate.
         max_workers: Number of parallel workers for EXIF extraction.
+                     Defaults to the CPU count; workers start only as chunks arrive.
+        file_signatures: Optional dict filled with path -> (mtime_ns, size)
+                         for every file handed to ExifTool.
     """
-    import concurrent.futures
-    
     dcim_path = os.path.join(mount_point, "DCIM")
-    all_paths = []
     
     if not os.path.exists(dcim_path):
         print(f"DCIM not found at {dcim_path}")
         return []
 
-    for root, dirs, files in os.walk(dcim_path):
-        # print(root, len(files)) # Reduce noise
-        for f in files:
-            lower_f = f.lower()
-            if lower_f.endswith(('.jpg', '.jpeg', '.png', '.heic', '.mov', '.mp4')):
-                full_path = os.path.join(root, f)
-                # Optimization: Skip if already in DB
-                if existing_files and full_path in existing_files:
-                    continue
-                all_paths.append(full_path)
-    
-    if not all_paths:
-        return []
-
     metadata_list = []
     chunk_size = 50 # Smaller chunk size for better parallelism with threads
-    chunks = [all_paths[i:i + chunk_size] for i in range(0, len(all_paths), chunk_size)]
-    
-    print(f"Processing {len(all_paths)} files in {len(chunks)} chunks with {max_workers} workers...")
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all chunks
-        future_to_chunk = {executor.submit(process_chunk, chunk): chunk for chunk in chunks}
-        
-        for future in concurrent.futures.as_completed(future_to_chunk):
-            try:
-                data = future.result()
-                if data:
-                    if callback:
-                        callback(data)
-                    metadata_list.extend(data)
-            except Exception as e:
-                print(f"Chunk processing failed: {e}")
-        
+    # Each worker thread drives its own ExifTool (perl) process, so decoding
+    # already runs on separate cores; threads only wait on the pipes. Size the
+    # pool to the machine. The pool is effectively clamped to the number of
+    # chunks: the executor only starts a thread when a submitted chunk finds
+    # none idle, and each thread starts its ExifTool on its first chunk, so
+    # small scans don't spawn idle processes.
+    max_workers = max(1, max_workers or os.cpu_count() or 4)
+
+    # One stay_open ExifTool process per worker thread, reused for every chunk
+    # that thread handles, so the perl start-up cost is paid once per worker
+    # instead of once per chunk. The ExitStack shuts them all down at the end.
+    local = threading.local()
+    lock = threading.Lock()
+
+    def run_chunk(chunk: List[str]) -> List[Dict[str, Any]]:
+        et = getattr(local, "et", None)
+        if et is None or not et.running:
+            with lock:
+                et = helpers.enter_context(
+                    exiftool.ExifToolHelper(check_execute=False, common_args=EXIFTOOL_ARGS)
+                )
+            local.et = et
+        return process_chunk(chunk, et)
+
+    def collect(future: concurrent.futures.Future):
+        try:
+            data = future.result()
+        except Exception as e:
+            print(f"Chunk processing failed: {e}")
+            return
+        if data:
+            if callback:
+                # Not caught: a failed write must not count as processed
+                callback(data)
+            metadata_list.extend(data)
+
+    num_files = num_chunks = 0
+    with contextlib.ExitStack() as helpers, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # The walk feeds the workers: each chunk is submitted as soon as it
+        # fills, so ExifTool runs while the (slow, over ifuse) walk continues,
+        # and finished chunks reach the callback without waiting for the walk.
+        pending = set()
+        chunk = []
+        try:
+            for path in _iter_media_paths(dcim_path, existing_files, file_signatures):
+                chunk.append(path)
+                if len(chunk) < chunk_size:
+                    continue
+                pending.add(executor.submit(run_chunk, chunk))
+                num_files += len(chunk)
+                num_chunks += 1
+                chunk = []
+                # Hand finished chunks over; if the walk is more than a couple of
+                # chunks per worker ahead, wait for one rather than queueing the
+                # whole library's paths.
+                if len(pending) >= 2 * max_workers:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                else:
+                    done = {future for future in pending if future.done()}
+                    pending -= done
+                for future in done:
+                    collect(future)
+            if chunk:
+                pending.add(executor.submit(run_chunk, chunk))
+                num_files += len(chunk)
+                num_chunks += 1
+
+            for future in concurrent.futures.as_completed(pending):
+                collect(future)
+        except BaseException:
+            # The callback failed (or the scan was interrupted): don't run the
+            # chunks still queued
+            for future in pending:
+                future.cancel()
+            raise
+
+    if num_files:
+        print(f"Processed {num_files} files in {num_chunks} chunks with up to {min(max_workers, num_chunks)} workers")
     return metadata_list
@@ -1,22 +1,59 @@
 from mcp.server.fastmcp import FastMCP
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from mcp.server.fastmcp.utilities.types import Image
+import concurrent.futures
+import contextlib
 import os
+import shutil
+import threading
+import orjson
 try:
-    from .database import Database
+    from .database import Database, AsyncDatabase
     from .device import mount_device, scan_photos, get_devices, get_device_info, unmount_device
 except ImportError:
-    from database import Database
+    from database import Database, AsyncDatabase
     from device import mount_device, scan_photos, get_devices, get_device_info, unmount_device
 
+@contextlib.asynccontextmanager
+async def _lifespan(server: FastMCP):
+    # Once the server starts (not on import), load the embedding model and
+    # vector index in the background, so the first search doesn't pay for it
+    threading.Thread(target=db.warm_up, daemon=True).start()
+    yield
+
 # Initialize FastMCP server
-mcp = FastMCP("iOS MCP Server")
+mcp = FastMCP("iOS MCP Server", lifespan=_lifespan)
 
 # Initialize Database
 db = Database()
+# Read-only tools await this so concurrent calls don't block the event loop
+adb = AsyncDatabase(db)
 
 # Configuration
 MOUNT_POINT = "/tmp/iphone"
+# Concurrent file copies in copy_files_to_local
+COPY_WORKERS = 8
+# Scanned records buffered before each database write in scan_and_cache_photos
+INSERT_FLUSH_SIZE = 500
+# Seconds check_mount_status waits on the mount point before reporting it unresponsive
+MOUNT_CHECK_TIMEOUT = 2.0
+
+def _to_json(value: Any) -> str:
+    """
+    Serialise a tool result as JSON in one native pass (str() of large results
+    goes through a Python-level repr per element). Values JSON can't represent
+    fall back to their str().
+    """
+    return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+def _inside_mount(path: str) -> bool:
+    """
+    Whether `path` lies inside MOUNT_POINT. ".." segments are resolved first,
+    and a sibling such as "/tmp/iphone2" doesn't count as inside "/tmp/iphone".
+    """
+    root = MOUNT_POINT.rstrip("/")
+    path = os.path.normpath(path)
+    return path == root or path.startswith(root + "/")
 
 @mcp.tool()
 def list_connected_devices() -> str:
@@ -36,7 +73,11 @@ def get_device_details(udid: str) -> str:
     rc, info, err = get_device_info(udid)
     if rc != 0:
         return f"Error getting info: {err}"
-    return str(info)
+    # orjson encodes the (often large) plist dict in one native pass.
+    try:
+        return orjson.dumps(info, default=str, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+    except orjson.JSONEncodeError as e:
+        return f"Error encoding device info: {e}"
 
 @mcp.tool()
 def scan_and_cache_photos() -> str:
@@ -52,28 +93,58 @@ def scan_and_cache_photos() -> str:
     # 2. Scan
     try:
         # Optimization: Fetch existing files map to skip re-scanning
+        # (path -> mtime/size at index time, so modified files are picked up again)
         existing_files = db.get_existing_files_map()
+        file_signatures = {}
         
-        # Callback to insert data as soon as it is processed
+        # Processed chunks are buffered and written INSERT_FLUSH_SIZE records at
+        # a time: each upsert (embedding + index update) has a fixed cost.
+        pending = []
+
+        def flush():
+            if pending:
+                db.upsert_files(pending)
+                db.record_file_signatures({
+                    m['SourceFile']: file_signatures[m['SourceFile']]
+                    for m in pending if m.get('SourceFile') in file_signatures
+                })
+                print(f"Inserted batch of {len(pending)} files")
+                pending.clear()
+
+        # Callback to insert data as soon as enough is processed
         def insert_chunk(chunk: List[Dict[str, Any]]):
-            if chunk:
-                db.upsert_files(chunk)
-                print(f"Inserted chunk of {len(chunk)} files")
+            pending.extend(chunk)
+            if len(pending) >= INSERT_FLUSH_SIZE:
+                flush()
 
-        metadata_list = scan_photos(MOUNT_POINT, existing_files=existing_files, callback=insert_chunk)
+        db.enable_bulk_mode()
+        try:
+            metadata_list = scan_photos(
+                MOUNT_POINT,
+                existing_files=existing_files,
+                callback=insert_chunk,
+                file_signatures=file_signatures
+            )
+        finally:
+            try:
+                flush() # Whatever is left, even if the scan failed part way
+            finally:
+                db.disable_bulk_mode()
     except Exception as e:
         return f"Error scanning photos: {e}"
         
     # 3. Final Report
+    # Cached files handed to ExifTool again were modified: they weren't skipped
+    skipped = len(existing_files) - sum(1 for path in file_signatures if path in existing_files)
     if metadata_list:
-        # Note: upsert_files is now called incrementally via callback.
-        # We might want to do a final upsert if any were missed, but callback handles all.
-        return f"Successfully indexed {len(metadata_list)} new files. (Skipped {len(existing_files)})"
+        # Note: upsert_files is called incrementally via callback, and the
+        # last partial batch is flushed once the scan returns.
+        return f"Successfully indexed {len(metadata_list)} new files. (Skipped {skipped})"
     else:
-        return f"No new files found. (Already cached {len(existing_files)})"
+        return f"No new files found. (Already cached {skipped})"
 
 @mcp.tool()
-def search_files(query: str, n_results: int = 10) -> str:
+async def search_files(query: str, n_results: int = 10) -> str:
     """
     Search for files using metadata values without mentioning keys.
     n_results is the number of results to return. If not needed pass None.
@@ -90,11 +161,11 @@ def search_files(query: str, n_results: int = 10) -> str:
     4. Available metadata includes: EXIF (Camera, Lens, ISO), Composite (GPS, ShutterSpeed), MakerNotes, IPTC, and XMP. Call get_metadata_keys() to see all available metadata keys in DB. 
     """
     # ChromaDB handles the embedding and semantic search
-    results = db.query_files(query=query, n_results=n_results)
-    return str(results)
+    results = await adb.query_files(query=query, n_results=n_results)
+    return _to_json(results)
 
 @mcp.tool()
-def filter_files(criteria: str, n_results: int = 10) -> str:
+async def filter_files(criteria: str, n_results: int = 10) -> str:
     """
     Filter files by exact metadata values using MongoDB-style operators.
     Input must be a valid JSON string.
@@ -128,14 +199,13 @@ def filter_files(criteria: str, n_results: int = 10) -> str:
         ]
       }
     """
-    import json
     try:
-        where_clause = json.loads(criteria)
-    except json.JSONDecodeError:
+        where_clause = orjson.loads(criteria)
+    except orjson.JSONDecodeError:
         return "Error: Criteria must be a valid JSON string."
         
-    results = db.query_files(where=where_clause)
-    return str(results)
+    results = await adb.query_files(where=where_clause)
+    return _to_json(results)
 
 @mcp.tool()
 def mount_device_for_file_access():
@@ -166,7 +236,7 @@ def get_metadata_categories() -> str:
     Use this first to see what kind of metadata is available.
     """
     keys = db.get_cached_keys(category=None)
-    return str(keys)
+    return _to_json(keys)
 
 @mcp.tool()
 def get_metadata_keys(category: str = None, refresh: bool = False) -> str:
@@ -183,7 +253,7 @@ def get_metadata_keys(category: str = None, refresh: bool = False) -> str:
     2. Call `get_metadata_keys(category='EXIF')` to see all EXIF keys.
     """
     keys = db.get_cached_keys(category=category, refresh=refresh)
-    return str(keys)
+    return _to_json(keys)
 
 @mcp.tool()
 def find_similar_metadata_keys(key_name: str) -> str:
@@ -192,6 +262,8 @@ def find_similar_metadata_keys(key_name: str) -> str:
     Use this if a filter fails or if you are unsure of the exact field name.
     """
     matches = db.find_similar_keys(key_name)
+    if matches == [key_name]:
+        return f"'{key_name}' is a valid metadata key."
     if matches:
         return f"Did you mean one of these? {matches}"
     else:
@@ -204,7 +276,7 @@ def read_image(file_path: str) -> Image:
     """
     
     # Security check: ensure path is within mount point
-    if not file_path.startswith(MOUNT_POINT):
+    if not _inside_mount(file_path):
         raise ValueError("Access denied: File is outside the mount point.")
         
     if not os.path.exists(file_path):
@@ -224,7 +296,6 @@ def copy_files_to_local(source_paths: List[str], destination_folder: str, new_fi
         new_filenames: Optional. List of new filenames corresponding to source_paths. 
                        Must have same length as source_paths if provided.
     """
-    import shutil
     
     # Validation for rename
     if new_filenames:
@@ -238,35 +309,49 @@ def copy_files_to_local(source_paths: List[str], destination_folder: str, new_fi
         except Exception as e:
             return f"Error creating destination folder: {e}"
             
-    success_count = 0
-    errors = []
-    
-    # Create an iterator for new_filenames if it exists, else use None
-    # We use enumerate to get index for new_filenames access if needed, 
-    # but zip is cleaner if we handle the None case.
-    
-    for i, src in enumerate(source_paths):
-        if not src.startswith(MOUNT_POINT):
-            errors.append(f"{src}: Access denied (outside mount point)")
-            continue
-            
-        if not os.path.exists(src):
-            errors.append(f"{src}: File not found")
-            continue
+    # Determine every destination path up front
+    if new_filenames:
+        dest_paths = [os.path.join(destination_folder, name) for name in new_filenames]
+    else:
+        dest_paths = [os.path.join(destination_folder, os.path.basename(src)) for src in source_paths]
+
+    def copy_one(src: str, dest_path: str) -> Optional[str]:
+        """Copy one file; returns an error message, or None on success."""
+        if not _inside_mount(src):
+            return f"{src}: Access denied (outside mount point)"
             
         try:
-            # Determine destination path
-            if new_filenames:
-                dest_filename = new_filenames[i]
-                dest_path = os.path.join(destination_folder, dest_filename)
-            else:
-                filename = os.path.basename(src)
-                dest_path = os.path.join(destination_folder, filename)
-            
             shutil.copy2(src, dest_path)
-            success_count += 1
+            return None
+        except FileNotFoundError as e:
+            # Opening the source is the existence check: no separate stat over ifuse
+            if e.filename == src:
+                return f"{src}: File not found"
+            return f"{src}: {str(e)}"
         except Exception as e:
-            errors.append(f"{src}: {str(e)}")
+            return f"{src}: {str(e)}"
+
+    # Copies sharing a destination (same basename, or a repeated new name) run
+    # one after another in input order, as they did before copies overlapped,
+    # so the last one wins instead of several writing the file at once.
+    by_dest: Dict[str, List[int]] = {}
+    for i, dest_path in enumerate(dest_paths):
+        by_dest.setdefault(os.path.normcase(os.path.abspath(dest_path)), []).append(i)
+
+    results: List[Optional[str]] = [None] * len(source_paths)
+
+    def copy_group(indices: List[int]):
+        for i in indices:
+            results[i] = copy_one(source_paths[i], dest_paths[i])
+
+    # Reads off the ifuse mount are latency-bound, so overlapping a few copies
+    # keeps the USB link busy. Errors are reported in input order.
+    max_workers = max(1, min(COPY_WORKERS, len(by_dest)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in [executor.submit(copy_group, indices) for indices in by_dest.values()]:
+            future.result()
+    errors = [error for error in results if error is not None]
+    success_count = len(results) - len(errors)
             
     if not errors:
         return f"Successfully copied all {success_count} files to {destination_folder}"
@@ -295,11 +380,23 @@ def check_mount_status() -> str:
     Check the status of the file system mount point.
     Returns "Mounted" if successful, "Not Mounted" if not, or an error message.
     """
+    # A dead ifuse mount can block stat/readdir until the FUSE timeout, so the
+    # probe runs on a daemon thread and is abandoned if it takes too long.
+    result = []
+    probe = threading.Thread(target=lambda: result.append(_probe_mount()), daemon=True)
+    probe.start()
+    probe.join(MOUNT_CHECK_TIMEOUT)
+    if not result:
+        return f"Mounted but Not Responding (no answer within {MOUNT_CHECK_TIMEOUT:g}s)"
+    return result[0]
+
+def _probe_mount() -> str:
     try:
         if os.path.ismount(MOUNT_POINT):
-            # Additional check: try to list directory to ensure it's readable
+            # Additional check: read the first directory entry to ensure it's readable
             try:
-                os.listdir(MOUNT_POINT)
+                with os.scandir(MOUNT_POINT) as it:
+                    next(it, None)
                 return "Mounted and Readable"
             except PermissionError:
                 return "Mounted but Permission Denied"
@@ -314,7 +411,7 @@ def check_mount_status() -> str:
         return f"Error checking mount status: {e}"
 
 @mcp.tool()
-def count_files(criteria: str = None) -> str:
+async def count_files(criteria: str = None) -> str:
     """
     Count files matching the criteria.
     Input can be a JSON string with "query" (semantic) and/or "where" (filter).
@@ -327,13 +424,12 @@ def count_files(criteria: str = None) -> str:
 
     NOTE: Semantic count ("query") is based on METADATA similarity, not visual content.
     """
-    import json
     query = None
     where = None
     
     if criteria:
         try:
-            data = json.loads(criteria)
+            data = orjson.loads(criteria)
             if isinstance(data, dict):
                 query = data.get("query")
                 where = data.get("where")
@@ -343,15 +439,15 @@ def count_files(criteria: str = None) -> str:
             else:
                 # If JSON but not dict (e.g. list), treat as query string
                 query = str(data)
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # Not JSON, treat as semantic query
             query = criteria
             
-    count = db.count_files(query=query, where=where)
+    count = await adb.count_files(query=query, where=where)
     return str(count)
 
 @mcp.tool()
-def group_files(field: str, criteria: str = None) -> str:
+async def group_files(field: str, criteria: str = None) -> str:
     """
     Group files by a metadata field and return counts.
     Useful for getting a breakdown of files (e.g. by 'Model', 'CreationDate', 'Extension').
@@ -360,13 +456,12 @@ def group_files(field: str, criteria: str = None) -> str:
         field: The metadata field to group by (e.g. "Model", "ext").
         criteria: Optional JSON string for filtering before grouping.
     """
-    import json
     query = None
     where = None
     
     if criteria:
         try:
-            data = json.loads(criteria)
+            data = orjson.loads(criteria)
             if isinstance(data, dict):
                 query = data.get("query")
                 where = data.get("where")
@@ -374,23 +469,23 @@ def group_files(field: str, criteria: str = None) -> str:
                     where = data
             else:
                 query = str(data)
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             query = criteria
             
-    groups = db.group_files_by_field(field=field, query=query, where=where)
-    return str(groups)
+    groups = await adb.group_files_by_field(field=field, query=query, where=where)
+    return _to_json(groups)
 
 @mcp.tool()
-def get_database_summary() -> str:
+async def get_database_summary() -> str:
     """
     Get a summary of the database statistics (total files, etc).
     """
-    stats = db.get_database_stats()
-    return str(stats)
+    stats = await adb.get_database_stats()
+    return _to_json(stats)
 
 
 @mcp.tool()
-def run_advanced_query(criteria: str) -> str:
+async def run_advanced_query(criteria: str) -> str:
     """
     Run a complex query on the file database with support for filtering, semantic search, sorting, pagination, and projection.
     
@@ -431,17 +526,16 @@ def run_advanced_query(criteria: str) -> str:
          "offset": 20
        }
     """
-    import json
     try:
-        data = json.loads(criteria)
-    except json.JSONDecodeError:
+        data = orjson.loads(criteria)
+    except orjson.JSONDecodeError:
         return "Error: Input must be a valid JSON string."
         
     if not isinstance(data, dict):
         return "Error: Input must be a JSON object."
         
     try:
-        results = db.advanced_query(
+        results = await adb.advanced_query(
             query=data.get("query"),
             where=data.get("where"),
             sort_by=data.get("sort_by"),
@@ -450,13 +544,13 @@ def run_advanced_query(criteria: str) -> str:
             offset=data.get("offset", 0),
             projection=data.get("projection")
         )
-        return str(results)
+        return _to_json(results)
     except Exception as e:
         return f"Error executing query: {e}"
 
 
 @mcp.tool()
-def run_aggregation_pipeline(pipeline: str) -> str:
+async def run_aggregation_pipeline(pipeline: str) -> str:
     """
     Run a multi-stage aggregation pipeline for complex data processing.
     Modeled after MongoDB's aggregation framework.
@@ -534,18 +628,17 @@ def run_aggregation_pipeline(pipeline: str) -> str:
     ]
     ```
     """
-    import json
     try:
-        pipeline_data = json.loads(pipeline)
-    except json.JSONDecodeError:
+        pipeline_data = orjson.loads(pipeline)
+    except orjson.JSONDecodeError:
         return "Error: Pipeline must be a valid JSON string."
         
     if not isinstance(pipeline_data, list):
         return "Error: Pipeline must be a list of stages."
         
     try:
-        results = db.aggregate(pipeline_data)
-        return str(results)
+        results = await adb.aggregate(pipeline_data)
+        return _to_json(results)
     except Exception as e:
         return f"Error executing pipeline: {e}"
 
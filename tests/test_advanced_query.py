@@ -79,3 +79,31 @@ def test_complex_filter(db):
     }
     results = db.advanced_query(where=where)
     assert len(results) == 3 # All apples are >= 100
+
+def test_semantic_sort_on_empty_collection(tmp_path):
+    empty = Database(db_path=str(tmp_path))
+    assert empty.advanced_query(query="Apple", sort_by="ISO") == []
+    assert empty.group_files_by_field("Make", query="Apple") == {}
+    assert empty.aggregate([{"$match": {"query": "Apple"}}, {"$sort": {"ISO": 1}}]) == []
+
+def test_projection_and_narrow_include(tmp_path, monkeypatch):
+    db = Database(db_path=str(tmp_path))
+    db.upsert_files([{"SourceFile": "/tmp/a.jpg", "Make": "Apple", "ISO": 100}])
+
+    calls = []
+    original_get = db.collection.get
+    def spy_get(**kwargs):
+        calls.append(kwargs)
+        return original_get(**kwargs)
+    monkeypatch.setattr(db.collection, "get", spy_get)
+
+    rows = db.query_files(where={"Make": "Apple"}, projection=["ISO", "Missing"])
+    assert rows == [{"SourceFile": "/tmp/a.jpg", "ISO": 100}]
+    assert calls[-1]["include"] == ["metadatas"]
+    assert db.get_all_files(projection=["Make"]) == [{"SourceFile": "/tmp/a.jpg", "Make": "Apple"}]
+
+def test_semantic_count_bounded_by_max_scan(tmp_path):
+    db = Database(db_path=str(tmp_path))
+    db.upsert_files([{"SourceFile": f"/tmp/{i}.jpg", "Make": "Apple"} for i in range(5)])
+    assert db.count_files(query="Apple") == 5
+    assert db.count_files(query="Apple", max_scan=3) == 3
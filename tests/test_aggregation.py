@@ -1,6 +1,7 @@
 import chromadb
 import os
 import shutil
+import tempfile
 import pytest
 from src.database import Database
 
@@ -162,3 +163,189 @@ def test_match_in_operator(db):
     results = db.aggregate(pipeline)
     # Sony (1) + Canon (2) = 3
     assert len(results) == 3
+
+def test_in_memory_match_operators(db):
+    docs = [
+        {"Make": "Apple", "ISO": 100},
+        {"Make": "Canon", "ISO": 50},
+        {"Make": "Sony"},
+        {"Make": "Apple", "ISO": 800},
+    ]
+    assert db._stage_match(docs, {"ISO": {"$gte": 100}}) == [docs[0], docs[3]]
+    assert db._stage_match(docs, {"Make": {"$nin": ["Apple"]}}) == [docs[1], docs[2]]
+    # $or keeps document order even when later branches match earlier docs
+    assert db._stage_match(docs, {"$or": [{"ISO": 800}, {"Make": "Canon"}, {"ISO": {"$lt": 200}}]}) == [docs[0], docs[1], docs[3]]
+    assert db._stage_match(docs, {"$and": [{"Make": "Apple"}, {"ISO": {"$ne": 800}}]}) == [docs[0]]
+
+def test_leading_skip_limit_pushed_down(db, monkeypatch):
+    calls = []
+    original_get = db.collection.get
+    def spy_get(**kwargs):
+        calls.append(kwargs)
+        return original_get(**kwargs)
+    monkeypatch.setattr(db.collection, "get", spy_get)
+
+    everything = db.aggregate([{"$match": {"Make": "Apple"}}])
+    page = db.aggregate([{"$match": {"Make": "Apple"}}, {"$skip": 1}, {"$limit": 5}, {"$limit": 1}])
+    assert calls[-1]["offset"] == 1 and calls[-1]["limit"] == 1
+    assert [d["SourceFile"] for d in page] == [everything[1]["SourceFile"]]
+
+    assert db.aggregate([{"$limit": 0}, {"$count": "total"}]) == [{"total": 0}]
+    assert len(db.aggregate([{"$limit": 2}])) == 2
+
+def test_semantic_skip_is_capped(db, monkeypatch):
+    calls = []
+    original_query = db.collection.query
+    def spy_query(**kwargs):
+        calls.append(kwargs)
+        return original_query(**kwargs)
+    monkeypatch.setattr(db.collection, "query", spy_query)
+
+    assert db.aggregate([{"$match": {"query": "photo"}}, {"$skip": 1_000_000}, {"$limit": 5}]) == []
+    assert calls[-1]["n_results"] == db.collection.count()
+
+def test_compiled_pipeline_is_reused(db):
+    pipeline = [{"$match": {"Make": "Apple"}}, {"$group": {"_id": "$Model", "count": {"$sum": 1}}}, {"$sort": {"_id": 1}}]
+    first = db.aggregate([dict(stage) for stage in pipeline])
+    hits = db._compile_pipeline.cache_info().hits
+    second = db.aggregate([dict(stage) for stage in pipeline])
+    assert db._compile_pipeline.cache_info().hits == hits + 1
+    assert first == second == [{"_id": "iPhone 12", "count": 2}, {"_id": "iPhone 13", "count": 1}]
+
+def test_group_accumulators_single_pass(db):
+    docs = [
+        {"Make": "Apple", "ISO": 100, "Model": "iPhone 12"},
+        {"Make": "Apple", "ISO": "800", "Model": "iPhone 13"},
+        {"Make": "Apple", "ISO": "n/a", "Model": "iPhone 12"},
+        {"Make": "Canon", "Model": "EOS R5"},
+    ]
+    spec = {
+        "_id": "$Make",
+        "n": {"$sum": 1},
+        "total": {"$sum": "$ISO"},
+        "avg": {"$avg": "$ISO"},
+        "lo": {"$min": "$ISO"},
+        "hi": {"$max": "$ISO"},
+        "models": {"$push": "$Model"},
+        "first": {"$first": "$Model"},
+    }
+    apple, canon = db._stage_group(docs, spec)
+    assert apple == {"_id": "Apple", "n": 3, "total": 900.0, "avg": 450.0, "lo": 100.0, "hi": 800.0,
+                     "models": ["iPhone 12", "iPhone 13", "iPhone 12"], "first": "iPhone 12"}
+    assert canon == {"_id": "Canon", "n": 1, "total": 0, "avg": 0, "lo": None, "hi": None,
+                     "models": ["EOS R5"], "first": "EOS R5"}
+
+def test_sort_mixed_types_and_directions(db):
+    docs = [
+        {"id": 1, "Make": "Apple", "ISO": "200"},
+        {"id": 2, "Make": "Canon", "ISO": 50},
+        {"id": 3, "Make": "Apple", "ISO": 100},
+        {"id": 4, "Make": "Apple"},
+        {"id": 5, "Make": "Canon", "ISO": 50},
+    ]
+    # None < numbers < strings; no TypeError on mixed values
+    assert [d["id"] for d in db._stage_sort(list(docs), {"ISO": 1})] == [4, 2, 5, 3, 1]
+    assert [d["id"] for d in db._stage_sort(list(docs), {"Make": -1, "ISO": 1})] == [2, 5, 4, 3, 1]
+    assert [d["id"] for d in db._stage_sort(list(docs), {"Make": 1, "ISO": -1})] == [1, 3, 4, 2, 5]
+
+def test_count_only_pipeline_skips_fetching_rows(db, monkeypatch):
+    calls = []
+    original_get = db.collection.get
+    def spy_get(**kwargs):
+        calls.append(kwargs)
+        return original_get(**kwargs)
+    monkeypatch.setattr(db.collection, "get", spy_get)
+
+    assert db.aggregate([{"$match": {"Make": "Apple"}}, {"$count": "total"}]) == [{"total": 3}]
+    assert db.aggregate([{"$match": {"Make": "Apple"}}, {"$skip": 1}, {"$count": "total"}]) == [{"total": 2}]
+    assert db.aggregate([{"$limit": 4}, {"$count": "total"}]) == [{"total": 4}]
+    assert all(call.get("include") == [] for call in calls)
+
+def test_leading_matches_pushed_into_where(db, monkeypatch):
+    calls = []
+    original_get = db.collection.get
+    def spy_get(**kwargs):
+        calls.append(kwargs)
+        return original_get(**kwargs)
+    monkeypatch.setattr(db.collection, "get", spy_get)
+
+    results = db.aggregate([
+        {"$match": {"Make": "Apple", "ISO": {"$gte": 100}}}, # Implicit AND
+        {"$match": {"Model": {"$in": ["iPhone 12", "iPhone 13"]}}},
+        {"$match": {"CreationDate": {"$gte": "2023-01-02"}}}, # String range: stays in memory
+        {"$sort": {"ISO": 1}},
+    ])
+    assert [r["SourceFile"] for r in results] == ["/tmp/5.jpg", "/tmp/2.jpg"]
+    assert calls[-1]["where"] == {"$and": [
+        {"Make": "Apple"}, {"ISO": {"$gte": 100}}, {"Model": {"$in": ["iPhone 12", "iPhone 13"]}}
+    ]}
+
+def test_translate_to_chroma_where(db):
+    assert db._translate_to_chroma_where({"$or": [{"Make": "Apple"}, {"ISO": {"$lt": 100}}]}) == \
+        {"$or": [{"Make": "Apple"}, {"ISO": {"$lt": 100}}]}
+    assert db._translate_to_chroma_where({"$and": [{"Make": "Apple"}]}) == {"Make": "Apple"}
+    assert db._translate_to_chroma_where({"score": {"$lt": 1}}) is None
+    assert db._translate_to_chroma_where({"Make": {"$regex": "A"}}) is None
+    assert db._stage_match([{"ISO": 1}, {"ISO": 2}], {"ISO": {"$eq": 2}}) == [{"ISO": 2}]
+
+def test_later_match_with_mixed_in_list_stays_in_memory(db):
+    for values in ([100, "200"], [100, 200.5]):
+        results = db.aggregate([{"$match": {"ISO": {"$gte": 0}}}, {"$match": {"ISO": {"$in": values}}}])
+        assert sorted(r["SourceFile"] for r in results) == ["/tmp/1.jpg", "/tmp/5.jpg"]
+    assert db._translate_to_chroma_where({"ISO": {"$in": [True, 1]}}) is None
+    assert db._translate_to_chroma_where({"ISO": {"$in": [100, 200]}}) == {"ISO": {"$in": [100, 200]}}
+    assert db._translate_to_chroma_where({"ISO": {"$in": [100, 200]}}, exact=True) is None
+
+def test_later_int_equality_matches_bools_like_in_memory():
+    path = tempfile.mkdtemp()
+    try:
+        flags = Database(db_path=path)
+        flags.upsert_files([
+            {"SourceFile": "/tmp/a.jpg", "Make": "Apple", "Flag": True},
+            {"SourceFile": "/tmp/b.jpg", "Make": "Apple", "Flag": 0},
+        ])
+        results = flags.aggregate([{"$match": {"Make": "Apple"}}, {"$match": {"Flag": 1}}])
+        assert [r["SourceFile"] for r in results] == ["/tmp/a.jpg"]
+        results = flags.aggregate([{"$match": {"Make": "Apple"}}, {"$match": {"Flag": {"$ne": 1}}}])
+        assert [r["SourceFile"] for r in results] == ["/tmp/b.jpg"]
+
+        # Later stages give what the in-memory $match gives on the same rows
+        flags.upsert_files([{"SourceFile": "/tmp/c.jpg", "Make": "Apple", "Flag": 1}])
+        rows = flags.get_all_files()
+        for criteria in [{"Flag": {"$gt": 0}}, {"Flag": {"$gte": 1}}, {"Flag": {"$lt": 1}},
+                         {"Flag": {"$lte": 0.5}}, {"Flag": {"$in": [1, 0]}}, {"Flag": {"$in": [True]}},
+                         {"Flag": True}, {"Flag": {"$ne": True}}]:
+            results = flags.aggregate([{"$match": {"Make": "Apple"}}, {"$match": dict(criteria)}])
+            expected = flags._stage_match(rows, criteria)
+            assert sorted(r["SourceFile"] for r in results) == sorted(r["SourceFile"] for r in expected), criteria
+    finally:
+        shutil.rmtree(path)
+
+def test_sort_then_window_matches_full_sort(db):
+    docs = [{"id": i, "Make": ("Apple", "Canon", None)[i % 3], "ISO": (i * 37) % 11} for i in range(60)]
+    for spec in ({"ISO": 1}, {"ISO": -1}, {"Make": -1, "ISO": 1}):
+        expected = db._stage_sort(list(docs), spec)[3:8]
+        pipeline = [{"$sort": spec}, {"$skip": 3}, {"$limit": 5}]
+        assert db._build_pipeline(pipeline)(list(docs)) == expected
+
+def test_group_sum_constant(db):
+    docs = [{"Make": "Apple"}, {"Make": "Apple"}, {"Make": "Canon"}]
+    results = db._stage_group(docs, {"_id": "$Make", "n": {"$sum": 1}, "weight": {"$sum": 2.5}})
+    assert results == [{"_id": "Apple", "n": 2, "weight": 5.0}, {"_id": "Canon", "n": 1, "weight": 2.5}]
+
+def test_project_inclusion_and_exclusion(db):
+    docs = [{"_id": "Apple", "n": 2, "total": 5.0}, {"_id": "Canon", "n": 1}]
+    assert db._stage_project(docs, {"n": 1, "total": True}) == \
+        [{"_id": "Apple", "n": 2, "total": 5.0}, {"_id": "Canon", "n": 1}]
+    assert db._stage_project(docs, {"_id": 0, "total": 1}) == [{"total": 5.0}, {}]
+    assert db._stage_project(docs, {"_id": 0, "total": False}) == [{"n": 2}, {"n": 1}]
+
+def test_project_renames_fields(db):
+    results = db.aggregate([
+        {"$group": {"_id": "$Model", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": 2},
+        {"$project": {"Model": "$_id", "count": 1, "_id": 0}},
+    ])
+    assert results == [{"Model": "EOS R5", "count": 2}, {"Model": "iPhone 12", "count": 2}]
+    assert db._stage_project([{"_id": "A", "n": 1}], {"Make": "$_id"}) == [{"_id": "A", "Make": "A"}]
@@ -0,0 +1,55 @@
+import asyncio
+import shutil
+import tempfile
+import pytest
+from src.database import Database, AsyncDatabase
+
+@pytest.fixture
+def adb():
+    path = tempfile.mkdtemp()
+    db = Database(db_path=path)
+    db.upsert_files([
+        {"SourceFile": "/tmp/1.jpg", "Make": "Apple"},
+        {"SourceFile": "/tmp/2.jpg", "Make": "Apple"},
+        {"SourceFile": "/tmp/3.jpg", "Make": "Canon"},
+    ])
+    yield AsyncDatabase(db)
+    shutil.rmtree(path)
+
+def test_concurrent_reads(adb):
+    async def burst():
+        return await asyncio.gather(
+            adb.count_files(where={"Make": "Apple"}),
+            adb.group_files_by_field("Make"),
+            adb.query_files(where={"Make": "Canon"}),
+            adb.aggregate([{"$group": {"_id": "$Make", "n": {"$sum": 1}}}]),
+        )
+    count, groups, canon, grouped = asyncio.run(burst())
+    assert count == 2
+    assert groups == {"Apple": 2, "Canon": 1}
+    assert [f["SourceFile"] for f in canon] == ["/tmp/3.jpg"]
+    assert {g["_id"]: g["n"] for g in grouped} == {"Apple": 2, "Canon": 1}
+
+def test_concurrent_reads_and_writes(adb):
+    db = adb.db
+
+    async def burst(rounds):
+        return await asyncio.gather(*(
+            call for i in range(rounds) for call in (
+                adb.count_files(where={"Make": "Apple"}),
+                adb.aggregate([{"$match": {"Make": "Apple"}}, {"$count": "n"}]),
+                adb.group_files_by_field("Make"),
+                asyncio.to_thread(db.upsert_files, [{"SourceFile": f"/tmp/new{i}.jpg", "Make": "Apple"}]),
+            )
+        ))
+
+    results = asyncio.run(burst(20))
+    assert all(2 <= count <= 22 for count in results[0::4])
+    # Whatever the reads cached while the writes were landing, none of it is stale now
+    assert db.count_files(where={"Make": "Apple"}) == 22
+    assert db.group_files_by_field("Make") == {"Apple": 22, "Canon": 1}
+    assert len(db.get_all_files()) == 23
+
+def test_query_files_projection(adb):
+    rows = asyncio.run(adb.query_files(where={"Make": "Canon"}, projection=["Make"]))
+    assert rows == [{"SourceFile": "/tmp/3.jpg", "Make": "Canon"}]
@@ -0,0 +1,40 @@
+import os
+import threading
+import time
+from src import server
+
+def test_copies_to_one_destination_do_not_overlap(tmp_path, monkeypatch):
+    mount = tmp_path / "mount"
+    for folder in ("100APPLE", "101APPLE"):
+        (mount / folder).mkdir(parents=True)
+        (mount / folder / "IMG_0001.JPG").write_bytes(folder.encode())
+    (mount / "100APPLE" / "IMG_0002.JPG").write_bytes(b"other")
+    monkeypatch.setattr(server, "MOUNT_POINT", str(mount))
+
+    active = {}
+    overlaps = []
+    lock = threading.Lock()
+    real_copy2 = server.shutil.copy2
+    def slow_copy2(src, dest):
+        with lock:
+            if active.get(dest):
+                overlaps.append(dest)
+            active[dest] = True
+        time.sleep(0.05)
+        real_copy2(src, dest)
+        with lock:
+            active[dest] = False
+    monkeypatch.setattr(server.shutil, "copy2", slow_copy2)
+
+    dest = tmp_path / "out"
+    sources = [str(mount / "100APPLE" / "IMG_0001.JPG"), str(mount / "101APPLE" / "IMG_0001.JPG"),
+               str(mount / "100APPLE" / "IMG_0002.JPG")]
+    result = server.copy_files_to_local(sources, str(dest))
+    assert result.startswith("Successfully copied all 3 files")
+    assert overlaps == []
+    assert (dest / "IMG_0001.JPG").read_bytes() == b"101APPLE" # Last one wins, as when copies ran in turn
+
+    renamed = server.copy_files_to_local(sources, str(dest), new_filenames=["a.jpg", "b.jpg", "a.jpg"])
+    assert renamed.startswith("Successfully copied all 3 files")
+    assert overlaps == []
+    assert (dest / "a.jpg").read_bytes() == b"other"
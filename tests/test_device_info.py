@@ -0,0 +1,143 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+import io
+import tempfile
+
+# Add src to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.device import get_device_info, load_plist, mask_pii
+
+SAMPLE_PLIST = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+	<key>DeviceName</key>
+	<string>My iPhone</string>
+	<key>UniqueDeviceID</key>
+	<string>00008101-001E30590A0A001E</string>
+	<key>ProductVersion</key>
+	<string>17.1</string>
+	<key>PasswordProtected</key>
+	<true/>
+	<key>TrustedHostAttached</key>
+	<false/>
+	<key>BatteryLevel</key>
+	<integer>87</integer>
+	<key>Temperature</key>
+	<real>31.5</real>
+	<key>EmptyValue</key>
+	<string></string>
+	<key>Blob</key>
+	<data>
+	AAEC
+	</data>
+	<key>SupportedDeviceFamilies</key>
+	<array>
+		<integer>1</integer>
+		<integer>2</integer>
+	</array>
+	<key>CarrierBundleInfoArray</key>
+	<array>
+		<dict>
+			<key>IntegratedCircuitCardIdentity</key>
+			<string>secret_iccid</string>
+			<key>MCC</key>
+			<string>310</string>
+		</dict>
+	</array>
+</dict>
+</plist>"""
+
+EXPECTED = {
+    "DeviceName": "My iPhone",
+    "UniqueDeviceID": "REDACTED",
+    "ProductVersion": "17.1",
+    "PasswordProtected": True,
+    "TrustedHostAttached": False,
+    "BatteryLevel": 87,
+    "Temperature": 31.5,
+    "EmptyValue": "",
+    "Blob": "AAEC",
+    "SupportedDeviceFamilies": [1, 2],
+    "CarrierBundleInfoArray": [
+        {"IntegratedCircuitCardIdentity": "REDACTED", "MCC": "310"}
+    ],
+}
+
+def fake_popen(stdout: str, stderr: str = "", returncode: int = 0) -> MagicMock:
+    proc = MagicMock()
+    proc.__enter__.return_value = proc
+    proc.stdout = io.BytesIO(stdout.encode("utf-8"))
+    proc.stderr = io.BytesIO(stderr.encode("utf-8"))
+    proc.wait.return_value = returncode
+    return proc
+
+class TestDeviceInfo(unittest.TestCase):
+
+    @patch('subprocess.Popen')
+    def test_parse_device_info(self, mock_popen):
+        mock_popen.return_value = fake_popen(SAMPLE_PLIST)
+        rc, info, err = get_device_info("udid")
+        self.assertEqual(rc, 0)
+        self.assertEqual(info, EXPECTED)
+
+    def test_load_plist(self):
+        data = SAMPLE_PLIST.encode("utf-8")
+        self.assertEqual(mask_pii(load_plist(io.BytesIO(data))), EXPECTED)
+
+    def test_load_plist_date(self):
+        data = b'<?xml version="1.0"?><plist><dict><key>Activated</key><date>2024-03-01T10:00:00Z</date></dict></plist>'
+        self.assertEqual(load_plist(io.BytesIO(data)), {"Activated": "2024-03-01T10:00:00Z"})
+
+    @patch('subprocess.Popen')
+    def test_preamble_is_stripped(self, mock_popen):
+        mock_popen.return_value = fake_popen("Return code: 0\n" + SAMPLE_PLIST)
+        rc, info, err = get_device_info("udid")
+        self.assertEqual(rc, 0)
+        self.assertEqual(info["DeviceName"], "My iPhone")
+
+    @patch('subprocess.Popen')
+    def test_command_failure(self, mock_popen):
+        mock_popen.return_value = fake_popen("", "No device found", returncode=1)
+        rc, info, err = get_device_info("udid")
+        self.assertEqual(rc, 1)
+        self.assertEqual(info, {})
+        self.assertEqual(err, "No device found")
+
+    @patch('subprocess.Popen')
+    def test_malformed_plist(self, mock_popen):
+        mock_popen.return_value = fake_popen("<?xml version=\"1.0\"?><plist><dict>")
+        rc, info, err = get_device_info("udid")
+        self.assertEqual(rc, -1)
+        self.assertIn("Failed to parse plist", err)
+
+    def test_large_stderr_does_not_block(self):
+        # A real child process: 200 KB on stderr is more than the pipe holds
+        with tempfile.TemporaryDirectory() as bin_dir:
+            script = os.path.join(bin_dir, "ideviceinfo")
+            with open(script, "w") as f:
+                f.write(f"#!{sys.executable}\n"
+                        "import sys\n"
+                        "sys.stderr.write('w' * 200000)\n"
+                        "sys.stderr.flush()\n"
+                        f"sys.stdout.write({SAMPLE_PLIST!r})\n")
+            os.chmod(script, 0o755)
+            with patch.dict(os.environ, {"PATH": bin_dir + os.pathsep + os.environ.get("PATH", "")}):
+                rc, info, err = get_device_info("udid")
+        self.assertEqual(rc, 0)
+        self.assertEqual(info, EXPECTED)
+        self.assertEqual(len(err), 200000)
+
+    def test_device_details_tool_encodes_any_value(self):
+        from src import server
+        info = {"DeviceName": "My iPhone", "Blob": b"\x00\x01", "Tags": {"a"}}
+        with patch.object(server, "get_device_info", return_value=(0, info, "")):
+            self.assertIn('"DeviceName": "My iPhone"', server.get_device_details("udid"))
+        with patch.object(server, "get_device_info", return_value=(0, {"Huge": 1 << 70}, "")):
+            self.assertTrue(server.get_device_details("udid").startswith("Error encoding device info"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import pytest
+from src import device
+from src.device import _iter_media_paths
+from src.database import Database
+
+@pytest.fixture
+def dcim():
+    root = tempfile.mkdtemp()
+    dcim_path = os.path.join(root, "DCIM")
+    os.makedirs(os.path.join(dcim_path, "100APPLE"))
+    os.makedirs(os.path.join(dcim_path, "101APPLE", "nested"))
+    for name in ["100APPLE/IMG_0001.JPG", "100APPLE/IMG_0002.HEIC", "100APPLE/IMG_0002.AAE",
+                 "101APPLE/nested/IMG_0003.mov", "101APPLE/notes.txt"]:
+        with open(os.path.join(dcim_path, name), "w") as f:
+            f.write("data")
+    yield dcim_path
+    shutil.rmtree(root)
+
+def collect(dcim_path, existing_files=None, file_signatures=None):
+    found = _iter_media_paths(dcim_path, existing_files, file_signatures)
+    return sorted(os.path.relpath(p, dcim_path) for p in found)
+
+def test_collects_media_only(dcim):
+    assert collect(dcim) == [
+        "100APPLE/IMG_0001.JPG",
+        "100APPLE/IMG_0002.HEIC",
+        "101APPLE/nested/IMG_0003.mov",
+    ]
+
+def test_extension_filter(dcim):
+    for name in ["IMG_0004.DNG", "IMG_0005.heif", "IMG_0004.THM", ".DS_Store", "jpg"]:
+        with open(os.path.join(dcim, "100APPLE", name), "w") as f:
+            f.write("data")
+    collected = collect(dcim)
+    assert "100APPLE/IMG_0004.DNG" in collected
+    assert "100APPLE/IMG_0005.heif" in collected
+    assert len(collected) == 5
+
+def test_skips_paths_in_set(dcim):
+    existing = {os.path.join(dcim, "100APPLE/IMG_0001.JPG")}
+    assert collect(dcim, existing) == ["100APPLE/IMG_0002.HEIC", "101APPLE/nested/IMG_0003.mov"]
+
+def test_signature_map_rescans_modified_files(dcim):
+    signatures = {}
+    collect(dcim, file_signatures=signatures)
+    assert len(signatures) == 3
+
+    # Unchanged files are skipped; legacy entries without a signature are skipped too.
+    existing = dict(signatures)
+    existing[os.path.join(dcim, "101APPLE/nested/IMG_0003.mov")] = None
+    assert collect(dcim, existing, {}) == []
+
+    # Modify one file: it must be picked up again.
+    with open(os.path.join(dcim, "100APPLE/IMG_0002.HEIC"), "w") as f:
+        f.write("edited data")
+    fresh = {}
+    assert collect(dcim, existing, fresh) == ["100APPLE/IMG_0002.HEIC"]
+    assert list(fresh) == [os.path.join(dcim, "100APPLE/IMG_0002.HEIC")]
+
+def test_database_round_trips_signatures():
+    db_path = tempfile.mkdtemp()
+    try:
+        db = Database(db_path=db_path)
+        db.upsert_files([{"SourceFile": "/tmp/a.jpg"}, {"SourceFile": "/tmp/b.jpg"}])
+        db.record_file_signatures({"/tmp/a.jpg": (123, 4)})
+
+        existing = db.get_existing_files_map()
+        assert existing == {"/tmp/a.jpg": (123, 4), "/tmp/b.jpg": None}
+
+        db.clear_db()
+        assert db.get_existing_files_map() == {}
+        assert db.get_file_signatures() == {}
+    finally:
+        shutil.rmtree(db_path)
+
+def test_existing_files_map_backfills_from_collection():
+    db_path = tempfile.mkdtemp()
+    try:
+        db = Database(db_path=db_path)
+        # Written straight to Chroma, as by a build without the scan index.
+        db.collection.upsert(ids=["/tmp/a.jpg", "/tmp/b.jpg"], documents=["a", "b"])
+        db.record_file_signatures({"/tmp/gone.jpg": (1, 1)})
+
+        assert db.get_existing_files_map() == {"/tmp/a.jpg": None, "/tmp/b.jpg": None}
+        assert db.get_file_signatures() == {}
+    finally:
+        shutil.rmtree(db_path)
+
+def test_filter_existing_chunks_candidates():
+    db_path = tempfile.mkdtemp()
+    try:
+        db = Database(db_path=db_path)
+        db.upsert_files([{"SourceFile": f"/DCIM/IMG_{i}.JPG"} for i in range(5)])
+        candidates = [f"/DCIM/IMG_{i}.JPG" for i in range(3, 8)]
+        assert db.filter_existing(candidates, chunk_size=2) == {"/DCIM/IMG_3.JPG", "/DCIM/IMG_4.JPG"}
+        assert db.filter_existing([]) == set()
+    finally:
+        shutil.rmtree(db_path)
+
+class FakeExifTool:
+    started = 0
+
+    def __init__(self, **kwargs):
+        FakeExifTool.started += 1
+        self.running = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+
+    def get_metadata(self, chunk):
+        return [{"SourceFile": path} for path in chunk]
+
+def test_scan_starts_no_more_exiftools_than_chunks(dcim, monkeypatch):
+    monkeypatch.setattr(device.exiftool, "ExifToolHelper", FakeExifTool)
+    FakeExifTool.started = 0
+    found = device.scan_photos(os.path.dirname(dcim), max_workers=8)
+    assert len(found) == 3
+    assert FakeExifTool.started == 1 # One chunk: one ExifTool, not eight
+
+def test_scan_propagates_callback_errors(dcim, monkeypatch):
+    monkeypatch.setattr(device.exiftool, "ExifToolHelper", FakeExifTool)
+    def failing_write(chunk):
+        raise RuntimeError("upsert failed")
+    with pytest.raises(RuntimeError, match="upsert failed"):
+        device.scan_photos(os.path.dirname(dcim), callback=failing_write)
+
+def test_scan_report_skips_only_unchanged_files(dcim, monkeypatch):
+    from src import server
+    db_path = tempfile.mkdtemp()
+    try:
+        db = Database(db_path=db_path)
+        monkeypatch.setattr(server, "db", db)
+        monkeypatch.setattr(server, "MOUNT_POINT", os.path.dirname(dcim))
+        monkeypatch.setattr(server, "mount_device", lambda mount_point: (True, "Already mounted"))
+        monkeypatch.setattr(device.exiftool, "ExifToolHelper", FakeExifTool)
+        assert server.scan_and_cache_photos() == "Successfully indexed 3 new files. (Skipped 0)"
+
+        with open(os.path.join(dcim, "100APPLE/IMG_0002.HEIC"), "w") as f:
+            f.write("edited data")
+        assert server.scan_and_cache_photos() == "Successfully indexed 1 new files. (Skipped 2)"
+        assert server.scan_and_cache_photos() == "No new files found. (Already cached 3)"
+    finally:
+        shutil.rmtree(db_path)
@@ -48,6 +48,23 @@ class TestMetadataKeys(unittest.TestCase):
         keys2 = self.db.get_cached_keys(category="EXIF:")
         self.assertEqual(keys, keys2)
 
+    def test_cache_file_stores_categories(self):
+        self.db.update_keys_cache()
+        with open(self.db.cache_path) as f:
+            data = json.load(f)
+        self.assertIn("EXIF:Model", data["keys"])
+        self.assertEqual(data["categories"]["EXIF"], ["EXIF:ISO", "EXIF:Model"])
+        self.assertIn("General", data["categories"]["General"])
+        self.assertEqual(self.db.get_cached_keys(category="General"), data["categories"]["General"])
+
+    def test_old_cache_format_is_rewritten(self):
+        with open(self.db.cache_path, 'w') as f:
+            json.dump(["EXIF:Model", "XMP:XMP-dc:Title"], f)
+        self.assertEqual(self.db.get_cached_keys(), ["EXIF", "XMP"])
+        self.assertEqual(self.db.get_cached_keys(category="XMP:XMP-dc"), ["XMP:XMP-dc:Title"])
+        with open(self.db.cache_path) as f:
+            self.assertIn("categories", json.load(f))
+
     def test_refresh_cache(self):
         # Populate cache first
         self.db.get_cached_keys()
@@ -56,13 +73,23 @@ class TestMetadataKeys(unittest.TestCase):
         new_data = [{"SourceFile": "d.jpg", "NewCat:Key": "Value"}]
         self.db.upsert_files(new_data)
         
-        # Without refresh, should not see NewCat (because it's reading from stale cache)
+        # The cache is kept current by upsert_files, no refresh needed
+        keys = self.db.get_cached_keys()
+        self.assertIn("NewCat", keys)
+        
+        # Keys written behind the database's back only show up on refresh
+        self.db.collection.upsert(ids=["e.jpg"], documents=["e"], metadatas=[{"Hidden:Key": "Value"}])
         keys = self.db.get_cached_keys()
-        self.assertNotIn("NewCat", keys)
+        self.assertNotIn("Hidden", keys)
         
-        # With refresh, should see NewCat
+        # With refresh, should see Hidden
         keys = self.db.get_cached_keys(refresh=True)
-        self.assertIn("NewCat", keys)
+        self.assertIn("Hidden", keys)
+
+    def test_clear_db_resets_keys(self):
+        self.db.get_cached_keys()
+        self.db.clear_db()
+        self.assertEqual(self.db.get_all_keys(), set())
 
     def test_get_metadata_categories_tool(self):
         # This tests the underlying DB logic which the tool uses
@@ -104,5 +131,22 @@ class TestMetadataKeys(unittest.TestCase):
         # Restore cache
         self.db.update_keys_cache()
 
+    def test_find_similar_keys_exact_match(self):
+        self.assertEqual(self.db.find_similar_keys("EXIF:Model"), ["EXIF:Model"])
+
+    def test_find_similar_keys_ignores_case(self):
+        self.assertEqual(self.db.find_similar_keys("exif:iso", n=1), ["EXIF:ISO"])
+
+    def test_find_similar_keys_reuses_key_list(self):
+        self.db.find_similar_keys("Model")
+        keys_list = self.db._keys_list
+        self.assertIsNotNone(keys_list)
+        self.db.find_similar_keys("ISO")
+        self.assertIs(self.db._keys_list, keys_list)
+
+        # New keys invalidate the list
+        self.db.upsert_files([{"SourceFile": "d.jpg", "EXIF:LensModel": "Wide"}])
+        self.assertIn("EXIF:LensModel", self.db.find_similar_keys("LensModel"))
+
 if __name__ == '__main__':
     unittest.main()
@@ -5,7 +5,7 @@ import os
 # Add src to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.device import mask_pii, PII_FIELDS
+from src.device import mask_pii, _mask_pii_in_place, PII_FIELDS
 
 class TestPIIMasking(unittest.TestCase):
 
@@ -75,5 +75,17 @@ class TestPIIMasking(unittest.TestCase):
         self.assertEqual(masked["CarrierBundleInfoArray"][1]["GID1"], "REDACTED")
         self.assertEqual(masked["CarrierBundleInfoArray"][1]["Slot"], "1")
 
+    def test_mask_pii_in_place_matches_mask_pii(self):
+        info = {
+            "DeviceName": "My iPhone",
+            "SerialNumber": "F2LXYZ123ABC",
+            "BasebandKeyHashInformation": {"SKeyHash": "secret_hash", "OtherField": "safe"},
+            "CarrierBundleInfoArray": [{"GID1": "secret_gid", "Slot": "1"}, [{"ChipID": 7}], "plain"]
+        }
+        expected = mask_pii(info)
+        self.assertIs(_mask_pii_in_place(info), info)
+        self.assertEqual(info, expected)
+        self.assertEqual(_mask_pii_in_place("plain"), "plain")
+
 if __name__ == '__main__':
     unittest.main()
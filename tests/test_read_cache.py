@@ -0,0 +1,78 @@
+import shutil
+import tempfile
+import pytest
+from src.database import Database
+
+@pytest.fixture
+def db_path():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+def test_count_and_group_cache_invalidated_by_upsert(db_path):
+    db = Database(db_path=db_path)
+    db.upsert_files([{"SourceFile": "/tmp/a.jpg", "Make": "Apple"}])
+    assert db.count_files(where={"Make": "Apple"}) == 1
+    assert db.group_files_by_field("Make") == {"Apple": 1}
+
+    # Identical calls are served from the cache...
+    db.collection.upsert(ids=["/tmp/b.jpg"], documents=["b"], metadatas=[{"Make": "Apple"}])
+    assert db.count_files(where={"Make": "Apple"}) == 1
+
+    # ...until the database writes through upsert_files
+    db.upsert_files([{"SourceFile": "/tmp/c.jpg", "Make": "Canon"}])
+    assert db.count_files(where={"Make": "Apple"}) == 2
+    assert db.group_files_by_field("Make") == {"Apple": 2, "Canon": 1}
+
+def test_read_during_upsert_is_not_cached(db_path, monkeypatch):
+    db = Database(db_path=db_path)
+    db.upsert_files([{"SourceFile": "/tmp/a.jpg", "Make": "Apple"}])
+    original_upsert = db.collection.upsert
+    def upsert_with_reader(**kwargs):
+        # A concurrent read landing just before the write caches the old state
+        assert db.count_files(where={"Make": "Apple"}) == 1
+        assert len(db.get_all_files()) == 1
+        original_upsert(**kwargs)
+    monkeypatch.setattr(db.collection, "upsert", upsert_with_reader)
+
+    db.upsert_files([{"SourceFile": "/tmp/b.jpg", "Make": "Apple"}])
+    assert db.count_files(where={"Make": "Apple"}) == 2
+    assert len(db.get_all_files()) == 2
+
+def test_iter_all_files_pages(db_path):
+    db = Database(db_path=db_path)
+    db.upsert_files([{"SourceFile": f"/tmp/{i}.jpg", "ISO": i} for i in range(7)])
+    files = list(db.iter_all_files(page_size=3))
+    assert sorted(f["SourceFile"] for f in files) == [f"/tmp/{i}.jpg" for i in range(7)]
+    assert sorted(f["ISO"] for f in files) == list(range(7))
+    assert len(db.get_all_files()) == 7
+
+def test_full_scans_share_one_snapshot(db_path, monkeypatch):
+    db = Database(db_path=db_path)
+    db.upsert_files([{"SourceFile": f"/tmp/{i}.jpg", "ISO": i} for i in range(3)])
+
+    calls = []
+    original_get = db.collection.get
+    def spy_get(**kwargs):
+        calls.append(kwargs)
+        return original_get(**kwargs)
+    monkeypatch.setattr(db.collection, "get", spy_get)
+
+    files = db.get_all_files()
+    files[0]["ISO"] = "changed" # Callers get their own copies
+    db.update_keys_cache()
+    db.aggregate([{"$sort": {"ISO": -1}}])
+    page = db.advanced_query(sort_by="ISO", sort_order="desc", limit=2)
+    assert len(calls) == 1
+    assert [f["ISO"] for f in page] == [2, 1]
+
+    db.upsert_files([{"SourceFile": "/tmp/3.jpg", "ISO": 3}])
+    assert len(db.get_all_files()) == 4
+    assert len(calls) == 2
+
+def test_warm_up(db_path):
+    db = Database(db_path=db_path)
+    db.warm_up() # Empty collection: nothing to query
+    db.upsert_files([{"SourceFile": "/tmp/a.jpg", "Make": "Apple"}])
+    db.warm_up()
+    assert db._known_keys is not None
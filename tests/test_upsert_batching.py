@@ -0,0 +1,50 @@
+import shutil
+import tempfile
+import pytest
+from src.database import Database, _env_batch_size
+
+@pytest.fixture
+def db_path():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+def test_upsert_in_windows(db_path):
+    db = Database(db_path=db_path, batch_size=2)
+    db.get_all_keys() # Build the keys cache so upserts maintain it
+    data = [{"SourceFile": f"/tmp/{i}.jpg", f"EXIF:Key{i}": i} for i in range(5)]
+    data.append({"Directory": "/tmp"}) # No SourceFile: ignored
+    db.upsert_files(data)
+
+    assert db.count_files() == 5
+    assert set(db.get_existing_files_map()) == {f"/tmp/{i}.jpg" for i in range(5)}
+    assert {f"EXIF:Key{i}" for i in range(5)} <= db.get_all_keys()
+
+def test_bulk_mode_toggles_index_pragmas(db_path):
+    db = Database(db_path=db_path)
+    db.enable_bulk_mode()
+    assert db._index.execute("PRAGMA synchronous").fetchone()[0] == 0 # OFF
+    db.upsert_files([{"SourceFile": "/tmp/a.jpg"}])
+    db.disable_bulk_mode()
+    assert db._index.execute("PRAGMA synchronous").fetchone()[0] == 1 # NORMAL
+    assert db._index.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert list(db.get_existing_files_map()) == ["/tmp/a.jpg"]
+
+def test_upsert_files_soa(db_path):
+    db = Database(db_path=db_path, batch_size=2)
+    db.get_all_keys()
+    paths = [f"/tmp/{i}.jpg" for i in range(3)]
+    db.upsert_files_soa(paths, ["doc"] * 3, [{"SourceFile": p, "EXIF:ISO": 100} for p in paths])
+
+    assert sorted(f["SourceFile"] for f in db.get_all_files()) == paths
+    assert set(db.get_existing_files_map()) == set(paths)
+    assert "EXIF:ISO" in db.get_all_keys()
+    with pytest.raises(ValueError):
+        db.upsert_files_soa(paths, ["doc"], [{}])
+
+def test_env_batch_size(monkeypatch):
+    monkeypatch.delenv("MCP_CHROMA_BATCH", raising=False)
+    assert _env_batch_size() == 200
+    for value, expected in [("50", 50), ("0", 1), ("-5", 1), ("lots", 200), ("1.5", 200)]:
+        monkeypatch.setenv("MCP_CHROMA_BATCH", value)
+        assert _env_batch_size() == expected